@@ -0,0 +1,52 @@
+"""
+This script is a micro-benchmark for cdp_parser. It renders 'show cdp entry *' output for a core switch with many neighbors,
+then reports how many neighbors per second cdp_parser.parse gets through.
+
+Example: python benchmark_cdp_parser.py --neighbors 500 --rounds 200
+"""
+
+import time
+import argparse
+
+from cdp_parser import cdp_parser
+from benchmark_crawl import synthetic_topology
+
+def build_core_switch_output(neighbor_count) -> str:
+    """
+    This function renders CDP output for a core switch: mostly switches, plus a share of APs, phones and cameras.
+    """
+    entries = []
+
+    for index in range(neighbor_count):
+        local_port = f"TenGigabitEthernet{index // 48 + 1}/1/{index % 48 + 1}"
+
+        if index % 10 == 7:
+            entries.append(synthetic_topology.cdp_entry(f"core-fl01-{index:04d}-ap01", f"172.16.{index // 256}.{index % 256}", "cisco AIR-AP2802I-B-K9", "Trans-Bridge Source-Route-Bridge IGMP", local_port, "GigabitEthernet0"))
+        elif index % 10 == 8:
+            entries.append(synthetic_topology.cdp_entry(f"SEP{index:012X}", f"172.17.{index // 256}.{index % 256}", "Cisco IP Phone 8845", "Host Phone Two-port Mac Relay", local_port, "Port 1"))
+        elif index % 10 == 9:
+            entries.append(synthetic_topology.cdp_entry(f"CAM{index:06d}", f"172.18.{index // 256}.{index % 256}", "Cisco Video Surveillance 8030 IP Camera", "Host Network Camera", local_port, "eth0"))
+        else:
+            entries.append(synthetic_topology.cdp_entry(f"dist-fl01-nr01-sw{index:04d}.corp.local", f"10.1.{index // 256}.{index % 256}", "cisco WS-C3850-48P", "Router Switch IGMP", local_port, "TenGigabitEthernet1/1/1"))
+
+    return("\n".join(entries))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmark for cdp_parser.")
+    parser.add_argument('--neighbors', type=int, default=500, help="Neighbors in the synthetic core switch output.")
+    parser.add_argument('--rounds', type=int, default=200, help="How many times the output is parsed.")
+    arguments = parser.parse_args()
+
+    cdp_output = build_core_switch_output(arguments.neighbors)
+    parsed = cdp_parser.parse(cdp_output)
+
+    if len(parsed) != arguments.neighbors:
+        raise SystemExit(f"Parsed {len(parsed)} neighbors, expected {arguments.neighbors}.")
+
+    parse_start = time.perf_counter()
+    for _ in range(arguments.rounds):
+        cdp_parser.parse(cdp_output)
+    parse_seconds = time.perf_counter() - parse_start
+
+    print(f"Parsed {arguments.neighbors} neighbors x {arguments.rounds} rounds ({len(cdp_output) / 1024:.0f} KB per output) in {parse_seconds:.2f} seconds.")
+    print(f"{arguments.neighbors * arguments.rounds / parse_seconds:,.0f} neighbors/sec, {parse_seconds / arguments.rounds * 1000:.2f} ms per core switch output.")
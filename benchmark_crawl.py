@@ -0,0 +1,378 @@
+"""
+This script benchmarks the CDP crawler end to end against synthetic topologies, without any live gear.
+
+For every requested size it generates a topology (tree, mesh or ring core), renders matching 'show' outputs for every switch and WLC,
+loads them into the replay SSH backend, then runs cdpMasterDictHandler in a fresh process. It reports devices/sec, peak memory and
+per-stage time for each size, so it can be used as a regression gate for performance changes to the crawler.
+
+Example: python benchmark_crawl.py --topology tree mesh --sizes 10 100 1000 --aps 4 --phones 8 --cameras 1 --workers 8
+"""
+
+import os
+import sys
+import asyncio
+import time
+import random
+import logging
+import argparse
+import resource
+import contextlib
+import multiprocessing
+
+credential_test_host = "TEST-HOST-IP-OR-FQDN-GOES-HERE" # Must match cdpMasterDictHandler.ssh_credential_test
+
+class synthetic_topology():
+    """
+    This class generates a synthetic CDP topology and the CLI output every device in it would return.
+    """
+
+    def switch_name(site, index) -> str:
+        return(f"{site}-fl01-nr{index // 1000:02d}-sw{index % 1000:03d}")
+
+    def build_links(topology, switch_count, rng) -> list:
+        """
+        This function returns a list of (switch_index, switch_index) links for the requested topology shape.
+
+        tree: every switch hangs off the switch (index - 1) // 4, so each parent has up to 4 children.
+        mesh: a tree for connectivity, plus one extra random link per switch.
+        ring: up to 8 core switches in a ring, with the remaining switches spread over trees below the cores.
+        """
+        links = []
+
+        if topology == 'ring':
+            core_count = min(8, switch_count)
+            if core_count == 2:
+                links.append((0, 1))
+            elif core_count > 2:
+                for core in range(core_count):
+                    links.append((core, (core + 1) % core_count))
+            for index in range(core_count, switch_count):
+                links.append(((index - core_count) // 4, index)) # The first access switches hang off the cores, the rest off other access switches.
+            return(links)
+
+        for index in range(1, switch_count):
+            links.append(((index - 1) // 4, index))
+
+        if topology == 'mesh':
+            existing = set(links)
+            for index in range(switch_count):
+                peer = rng.randrange(switch_count)
+                if peer == index or (index, peer) in existing or (peer, index) in existing:
+                    continue
+                links.append((index, peer))
+                existing.add((index, peer))
+
+        return(links)
+
+    def cdp_entry(device_id, ip_addr, platform, capabilities, local_port, remote_port) -> str:
+        return(
+            "-------------------------\n"
+            f"Device ID: {device_id}\n"
+            "Entry address(es): \n"
+            f"  IP address: {ip_addr}\n"
+            f"Platform: {platform},  Capabilities: {capabilities} \n"
+            f"Interface: {local_port},  Port ID (outgoing port): {remote_port}\n"
+            "Holdtime : 150 sec\n"
+            "\n"
+            "Version :\n"
+            "Cisco IOS Software, Version 15.2(7)E4, RELEASE SOFTWARE (fc2)\n"
+            "\n"
+            "advertisement version: 2\n"
+            "Management address(es): \n"
+            f"  IP address: {ip_addr}\n"
+            "\n"
+        )
+
+    def switch_ip(site_number, index) -> str:
+        return(f"10.{site_number & 255}.{(index >> 8) & 255}.{index & 255}") # One /16 per site, so sites never share switch IPs (up to 256 sites of 65536 switches).
+
+    def endpoint_ip(index, endpoint) -> str:
+        return(f"172.{16 + (endpoint >> 8) % 16}.{index & 255}.{endpoint & 255}")
+
+    def __init__(self, site, topology, switch_count, aps, phones, cameras, seed=1, site_number=0):
+        """
+        Builds the recordings (host -> {command: output}) and the DNS zone (name <-> ip) for the synthetic site.
+        """
+        from scan_cdp_device import interrogation_commands
+
+        rng = random.Random(seed)
+        commands = interrogation_commands['cisco_ios']
+
+        self.site = site
+        self.site_number = site_number
+        self.seed_device = synthetic_topology.switch_name(site, 0)
+        self.recordings = {}
+        self.dns_zone = {}
+        self.ap_serials = {}
+        self.switch_count = switch_count
+
+        neighbors = {index: [] for index in range(switch_count)}
+        next_port = {index: 1 for index in range(switch_count)}
+        for a, b in synthetic_topology.build_links(topology, switch_count, rng):
+            a_port, b_port = f"TenGigabitEthernet1/1/{next_port[a]}", f"TenGigabitEthernet1/1/{next_port[b]}"
+            next_port[a] += 1
+            next_port[b] += 1
+            neighbors[a].append((b, a_port, b_port))
+            neighbors[b].append((a, b_port, a_port))
+
+        # The depth the crawl needs to reach every switch from the seed device.
+        distance = {0: 0}
+        queue = [0]
+        for index in queue:
+            for peer, _, _ in neighbors[index]:
+                if peer not in distance:
+                    distance[peer] = distance[index] + 1
+                    queue.append(peer)
+        self.scan_depth = max(distance.values()) + 2
+
+        for index in range(switch_count):
+            name = synthetic_topology.switch_name(site, index)
+            serial = f"FOC{index:08d}"
+            ip_addr = synthetic_topology.switch_ip(site_number, index)
+            self.dns_zone[name] = ip_addr
+
+            cdp_entries = []
+            mac_lines = []
+
+            for peer, local_port, remote_port in neighbors[index]:
+                cdp_entries.append(synthetic_topology.cdp_entry(
+                    synthetic_topology.switch_name(site, peer) + ".corp.local", synthetic_topology.switch_ip(site_number, peer),
+                    "cisco WS-C3850-48P", "Router Switch IGMP", local_port, remote_port))
+
+            endpoint = 0
+            for kind, count in (('ap', aps), ('phone', phones), ('camera', cameras)):
+                for number in range(count):
+                    endpoint += 1
+                    local_port = f"GigabitEthernet1/0/{endpoint}"
+                    endpoint_ip = synthetic_topology.endpoint_ip(index, endpoint)
+                    endpoint_mac = f"{index >> 8:04x}.{index & 255:04x}.{endpoint:04x}"
+
+                    if kind == 'ap':
+                        endpoint_name = f"{site}-fl01-{index:04d}-ap{number + 1:02d}"
+                        cdp_entries.append(synthetic_topology.cdp_entry(
+                            endpoint_name, endpoint_ip, "cisco AIR-AP2802I-B-K9", "Trans-Bridge Source-Route-Bridge IGMP", local_port, "GigabitEthernet0"))
+                        self.dns_zone[endpoint_name] = endpoint_ip
+                        self.ap_serials[endpoint_name] = f"FGL{index:05d}{number:03d}"
+                    elif kind == 'phone':
+                        endpoint_name = f"SEP{index:06X}{endpoint:06X}"
+                        cdp_entries.append(synthetic_topology.cdp_entry(
+                            endpoint_name, endpoint_ip, "Cisco IP Phone 8845", "Host Phone Two-port Mac Relay", local_port, "Port 1"))
+                    else:
+                        endpoint_name = f"CAM{index:06d}{endpoint:03d}"
+                        cdp_entries.append(synthetic_topology.cdp_entry(
+                            endpoint_name, endpoint_ip, "Cisco Video Surveillance 8030 IP Camera", "Host Network Camera", local_port, "eth0"))
+
+                    mac_lines.append(f" 250    {endpoint_mac}    DYNAMIC     Gi1/0/{endpoint}")
+                    self.recordings.setdefault(name, {})[f"show mac address-table interface {local_port} | i STATIC|DYNAMIC"] = mac_lines[-1]
+
+            recording = self.recordings.setdefault(name, {})
+            recording['__prompt__'] = f"{name}#"
+            recording[commands['version']] = f"Processor board ID {serial}"
+            recording[commands['inventory']] = f'NAME: "1", DESCR: "WS-C3850-48P"\nPID: WS-C3850-48P      , VID: V06  , SN: {serial}'
+            recording[commands['cdp']] = "\n".join(cdp_entries)
+            recording[commands['stp_macaddress']] = f"VLAN0001         {index >> 8:04x}.{index & 255:04x}.0000"
+            recording[commands['stp_blockedports']] = ""
+            recording['show mac address-table | i STATIC|DYNAMIC|static|dynamic'] = "\n".join(mac_lines)
+
+class crawl_benchmark():
+    """
+    This class runs one benchmark case in the current process and reports its numbers.
+    """
+
+    def install_dns_zone(dns_zone):
+        """
+        This function answers every nameserver query from the synthetic zone instead of a real resolver, so the benchmark only measures the crawler.
+        """
+        from dns_resolve_hostname import dns_resolve_hostname
+
+        reverse_zone = {ip_addr: name for name, ip_addr in dns_zone.items()}
+
+        def zone_answer(request_item, dns_type):
+            if dns_type == "IP":
+                return(reverse_zone.get(request_item, ''), 300)
+            if request_item in dns_zone:
+                return([dns_zone[request_item]], 300)
+            return([], 60)
+
+        def query_nameserver(request_item, dns_type):
+            time.sleep(float(os.environ.get('SSH-REPLAY-LATENCY', 0))) # A DNS round trip costs about as much as a command round trip.
+            return(zone_answer(request_item, dns_type))
+
+        async def query_nameserver_async(request_item, dns_type, async_resolver):
+            await asyncio.sleep(float(os.environ.get('SSH-REPLAY-LATENCY', 0)))
+            return(zone_answer(request_item, dns_type))
+
+        dns_resolve_hostname.query_nameserver = query_nameserver # Answers still go through the shared DNS cache, just like real ones.
+        dns_resolve_hostname.query_nameserver_async = query_nameserver_async
+
+    def install_probe_stub():
+        """
+        This function answers the SSH port probe from the replay recordings instead of real TCP connects: a host with a recording is up, any other host is down.
+        """
+        import ssh_transport
+        from ssh_reachability import ssh_reachability
+
+        def probe(host):
+            if host in ssh_transport.replay_recordings:
+                time.sleep(float(os.environ.get('SSH-REPLAY-LATENCY', 0))) # One round trip for the TCP handshake.
+                return(True)
+
+            time.sleep(float(os.environ.get('SSH-PROBE-TIMEOUT', 1.5)))
+            return(False)
+
+        ssh_reachability.probe = probe
+
+    def run_case(case) -> dict:
+        """
+        This function builds the case's synthetic sites, crawls them with cdpMasterDictHandler over the replay backend, and returns the measurements.
+        """
+        import ssh_transport
+
+        logging.disable(logging.CRITICAL) # Syslog output would dominate the run, and is not what is being measured.
+
+        build_start = time.perf_counter()
+        sites = []
+        dns_zone = {}
+        for site_number in range(case['sites']):
+            site = synthetic_topology(f"s{site_number:03d}", case['topology'], case['switches'], case['aps'], case['phones'], case['cameras'], seed=site_number + 1, site_number=site_number)
+            sites.append(site)
+            dns_zone.update(site.dns_zone)
+            ssh_transport.replay_recordings.update(site.recordings)
+            for name, ip_addr in site.dns_zone.items(): # The same recording answers sessions opened to the switch's IP, as with CDP-CONNECT-MODE=cdp-ip.
+                if name in site.recordings:
+                    ssh_transport.replay_recordings[ip_addr] = site.recordings[name]
+
+        from scan_cdp_AP_neighbor import wireless_controllers, wlc_inventory_commands
+
+        controller_recordings = [{} for controller in wireless_controllers]
+        inventory_blocks = [[] for controller in wireless_controllers]
+        ap_number = 0
+        for site in sites:
+            for ap_name, serial in site.ap_serials.items(): # APs are dealt out across the controllers by --wlc-weights, like a campus split between an old and a new WLC.
+                controller_number = case['wlc_deal'][ap_number % len(case['wlc_deal'])]
+                ap_number += 1
+                commands = wlc_inventory_commands[wireless_controllers[controller_number]['platform']]
+
+                controller_recordings[controller_number][commands['per-ap'].format(ap=ap_name)] = f'NAME: "AP2800", DESCR: "Cisco Aironet 2800 Series"\nPID: AIR-AP2802I-B-K9,  VID: V01,  SN: {serial}'
+                if wireless_controllers[controller_number]['platform'] == 'catalyst':
+                    inventory_blocks[controller_number].append(f"Cisco AP Name                                   : {ap_name}\nAP Serial Number                                : {serial}")
+                else:
+                    inventory_blocks[controller_number].append(f"Inventory for {ap_name}\n{controller_recordings[controller_number][commands['per-ap'].format(ap=ap_name)]}\n")
+
+        for controller, recording, blocks in zip(wireless_controllers, controller_recordings, inventory_blocks):
+            recording[wlc_inventory_commands[controller['platform']]['bulk']] = "\n".join(blocks) # Served when AP-INVENTORY-MODE is 'bulk'.
+            ssh_transport.replay_recordings[controller['host']] = recording
+        ssh_transport.replay_recordings[credential_test_host] = {}
+
+        if case['unreachable_every']: # Take every n-th switch off the network. Its sessions hang for SSH-REPLAY-TIMEOUT, then fail.
+            for site in sites:
+                for index in range(1, site.switch_count, case['unreachable_every']):
+                    ssh_transport.replay_recordings.pop(synthetic_topology.switch_name(site.site, index), None)
+                    ssh_transport.replay_recordings.pop(synthetic_topology.switch_ip(site.site_number, index), None)
+        build_seconds = time.perf_counter() - build_start
+
+        crawl_benchmark.install_dns_zone(dns_zone)
+        crawl_benchmark.install_probe_stub()
+
+        os.environ['SSH-TRANSPORT'] = 'replay'
+        os.environ['SSH-REPLAY-LATENCY'] = str(case['latency'])
+        os.environ['SSH-REPLAY-CONNECT-LATENCY'] = str(case['connect_latency'])
+        os.environ['SSH-REPLAY-TIMEOUT'] = str(case['ssh_timeout'])
+        os.environ['CDP-SCAN-DEPTH'] = str(max(site.scan_depth for site in sites))
+        os.environ['AP-SERIAL-CACHE-FILE'] = '' # Cold by default. Pass --env AP-SERIAL-CACHE-FILE=<path> and run twice to measure a warm cache.
+        os.environ['AP-AFFINITY-FILE'] = '' # Likewise for learned controller affinity. Without a file it is only learned within the run.
+        os.environ['SSH-NEGATIVE-CACHE-FILE'] = '' # Likewise for unreachable devices.
+        for key, value in case['env'].items():
+            os.environ[key] = value
+
+        from cdpMasterDictHandler import cdpMasterDictHandler
+
+        site_data = {site.site: {'cdp_seed_device': site.seed_device, 'site_id': number} for number, site in enumerate(sites)}
+
+        rss_before_crawl = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        crawl_start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            crawl_output = cdpMasterDictHandler(site_data)
+        crawl_seconds = time.perf_counter() - crawl_start
+
+        switches_found = 0
+        for site in sites:
+            device_scan_data = crawl_output.site_data_dict[site.site]['device_scan_data']
+            switches_found += len([device for device in device_scan_data.values() if 'cdp_neighbors' in device])
+
+        stage_totals = {}
+        for site_stages in crawl_output.stage_timings.values():
+            for stage, seconds in site_stages.items():
+                stage_totals[stage] = stage_totals.get(stage, 0) + seconds
+
+        return({
+            'topology': case['topology'],
+            'switches': case['switches'] * case['sites'],
+            'scanned': switches_found,
+            'build_seconds': build_seconds,
+            'crawl_seconds': crawl_seconds,
+            'devices_per_second': switches_found / sum(stage_totals.values()) if sum(stage_totals.values()) else 0, # Excludes the fixed credential test.
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # ru_maxrss is in KB on Linux.
+            'crawl_rss_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before_crawl) / 1024, # Growth during the crawl itself, without the synthetic fixtures.
+            'stages': stage_totals,
+            'ap_discovery_stats': crawl_output.ap_discovery_stats,
+            'dns_stats': crawl_output.dns_stats,
+            'reachability_stats': crawl_output.reachability_stats,
+        })
+
+    def run_isolated(case) -> dict:
+        """
+        This function runs a case in a fresh process, so peak memory is measured for that case alone.
+        """
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1) as pool:
+            return(pool.apply(crawl_benchmark.run_case, (case,)))
+
+    def report(result):
+        stages = "  ".join(f"{stage}={seconds:.2f}s" for stage, seconds in result['stages'].items())
+        stages += f"  wlc_queries={result['ap_discovery_stats']['controller_queries']}  affinity={result['ap_discovery_stats']['affinity_hits']}/{result['ap_discovery_stats']['routed_aps']}  dns_queries={result['dns_stats']['misses']}  probed={result['reachability_stats']['probed']}  cache_skipped={result['reachability_stats']['cache_skipped']}"
+        print(f"{result['topology']:<6} {result['switches']:>7} {result['scanned']:>8} {result['crawl_seconds']:>9.2f} {result['devices_per_second']:>10.1f} {result['peak_rss_mb']:>9.1f} {result['crawl_rss_mb']:>9.1f}  {stages}")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the CDP crawler against synthetic topologies.")
+    parser.add_argument('--topology', nargs='+', default=['tree', 'mesh', 'ring'], choices=['tree', 'mesh', 'ring'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10000], help="Switches per site.")
+    parser.add_argument('--sites', type=int, default=1, help="Identical synthetic sites crawled in the same run.")
+    parser.add_argument('--aps', type=int, default=2, help="APs per switch.")
+    parser.add_argument('--phones', type=int, default=4, help="Phones per switch.")
+    parser.add_argument('--cameras', type=int, default=1, help="Cameras per switch.")
+    parser.add_argument('--latency', type=float, default=0, help="Simulated seconds per command round trip.")
+    parser.add_argument('--connect-latency', type=float, default=0, help="Simulated seconds per SSH handshake.")
+    parser.add_argument('--unreachable-every', type=int, default=0, help="Take every n-th switch off the network, e.g. 10 for one dead switch in ten. 0 keeps every switch up.")
+    parser.add_argument('--ssh-timeout', type=float, default=0, help="Simulated seconds an SSH connect to an unreachable switch hangs before failing.")
+    parser.add_argument('--wlc-weights', nargs='+', type=int, default=[1, 1], help="How APs are dealt across wireless_controllers, e.g. 1 3 puts three of every four APs on the second controller.")
+    parser.add_argument('--env', nargs='*', default=[], help="Extra .env style settings for the crawl, e.g. CDP-SCAN-WORKERS=8")
+    parser.add_argument('--workers', type=int, default=None, help="Shortcut for CDP-SCAN-WORKERS.")
+    return(parser.parse_args())
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+
+    env = dict(setting.split('=', 1) for setting in arguments.env)
+    if arguments.workers:
+        env['CDP-SCAN-WORKERS'] = str(arguments.workers)
+
+    print(f"{'shape':<6} {'switches':>7} {'scanned':>8} {'crawl_s':>9} {'devices/s':>10} {'peak_MB':>9} {'crawl_MB':>9}  per-stage")
+    for topology in arguments.topology:
+        for size in arguments.sizes:
+            case = {
+                'topology': topology,
+                'switches': size,
+                'sites': arguments.sites,
+                'aps': arguments.aps,
+                'phones': arguments.phones,
+                'cameras': arguments.cameras,
+                'latency': arguments.latency,
+                'connect_latency': arguments.connect_latency,
+                'unreachable_every': arguments.unreachable_every,
+                'ssh_timeout': arguments.ssh_timeout,
+                'wlc_deal': [controller_number for controller_number, weight in enumerate(arguments.wlc_weights) for _ in range(weight)],
+                'env': env,
+            }
+            crawl_benchmark.report(crawl_benchmark.run_isolated(case))
+            sys.stdout.flush()
@@ -1,10 +1,15 @@
 import os
 import time
+import threading
 import logging, logging.handlers
 from pprint import pprint
-from netmiko import ConnectHandler
-from scan_cdp_device import scan_cdp_device
-from scan_cdp_AP_neighbor import scan_cdp_AP_neighbor
+from concurrent.futures import ThreadPoolExecutor
+from ssh_transport import ssh_transport
+from cdp_records import DeviceRecord
+from scan_cdp_device import scan_cdp_device, ssh_stats
+from scan_cdp_AP_neighbor import scan_cdp_AP_neighbor, ap_discovery_stats
+from dns_resolve_hostname import dns_resolve_hostname, dns_stats
+from ssh_reachability import ssh_reachability, reachability_stats
 from logger import myLogger
 
 class cdpMasterDictHandler():
@@ -14,6 +19,81 @@ class cdpMasterDictHandler():
     All other classes and functions are only used to collect or parse the data to be put into the master_dictionary.
     """
 
+    def store_device_data(site_data, site, device, cdp_device_data):
+        """
+        This function copies the results of a finished scan_cdp_device instance into the device's device_scan_data entry.
+
+        Both the serial and the concurrent scanning paths use this, so they always write the same dump.
+
+        The entry is stored as a compact DeviceRecord, which still reads like the old nested dict. Use serialize_site_data before dumping it.
+        """
+        site_data[site]['device_scan_data'][device] = DeviceRecord.from_scan(cdp_device_data)
+
+    def store_unreachable_device(site_data, site, device, reason, ip_addr, dns_name):
+        """
+        This function stores a device that was never SSH'd into because it failed the reachability screen, in the same shape as a failed SSH scan.
+
+        reason is 'probe' if it just failed the TCP probe, or 'negative cache' if it failed recently enough that it was not probed at all.
+        ip_addr and dns_name are what the scan would have stored for the device, so the dump does not depend on which path caught the failure.
+        """
+        device_record = DeviceRecord()
+        device_record.ip_addr = ip_addr
+        device_record.hostname = device
+        device_record.dns_name = dns_name
+        device_record.platform = False
+        device_record.stp_macaddress = False
+        device_record.stp_blockedports = False
+        device_record.serial_num = False
+        device_record.cdp_neighbors = False
+        device_record.scanned = True
+
+        site_data[site]['device_scan_data'][device] = device_record
+        unreachable_devices[site][device] = reason
+
+    def screen_wave(site_data, site, cdp_nei_scan_list):
+        """
+        This function runs the SSH reachability screen over a wave before it is scanned (SSH-PROBE-MODE 'tcp').
+
+        Devices that fail the TCP probe, or are still backing off in the negative cache, are stored as unreachable and flagged as scanned,
+        so the scan skips them instead of waiting out a full SSH connect timeout on each one.
+        """
+        probe_addresses = {}
+        device_addresses = {} # device -> (ip_addr, dns_name), the same values scan_cdp_device would have stored for it.
+        resolve_devices = []
+
+        for cdp_neighbor in cdp_nei_scan_list:
+            if cdp_neighbor in site_data[site]['device_scan_data'].keys() and site_data[site]['device_scan_data'][cdp_neighbor]['scanned'] == True:
+                continue
+
+            if advertised_ips[site].get(cdp_neighbor, '') != '' and os.environ.get('CDP-CONNECT-MODE', 'dns') == 'cdp-ip': # Probe the address the SSH session will actually be opened to.
+                probe_addresses[cdp_neighbor] = advertised_ips[site][cdp_neighbor]
+                device_addresses[cdp_neighbor] = (advertised_ips[site][cdp_neighbor], '') # dns_name is filled in later by enrich_site_dns, like for scanned devices.
+            else:
+                probe_addresses[cdp_neighbor] = cdp_neighbor
+                resolve_devices.append(cdp_neighbor)
+
+        if len(resolve_devices) >= 1: # Resolve through the shared DNS cache, which also warms it for the scans that follow.
+            dns_answers = dns_resolve_hostname.resolve_bulk(resolve_devices)
+
+            for cdp_neighbor in resolve_devices:
+                dns_answer = dns_answers.get(cdp_neighbor.lower().strip(), [])
+                if isinstance(dns_answer, list) and len(dns_answer) == 1:
+                    probe_addresses[cdp_neighbor] = dns_answer[0]
+
+                dns_output = dns_resolve_hostname(cdp_neighbor) # Answered from the cache just warmed, and read the same way scan_cdp_device reads it.
+                if dns_output.ip_addr == False:
+                    device_addresses[cdp_neighbor] = ('', '')
+                else:
+                    device_addresses[cdp_neighbor] = (dns_output.ip_addr, dns_output.dns_hostname)
+
+        screened = ssh_reachability.screen(probe_addresses)
+
+        for cdp_neighbor in screened['unreachable']:
+            cdpMasterDictHandler.store_unreachable_device(site_data, site, cdp_neighbor, 'probe', *device_addresses[cdp_neighbor])
+
+        for cdp_neighbor in screened['cache_skipped']:
+            cdpMasterDictHandler.store_unreachable_device(site_data, site, cdp_neighbor, 'negative cache', *device_addresses[cdp_neighbor])
+
     def scan_cdp_neighbors(site_data, site, cdp_nei_scan_list):
         """
         This function scans CDP neighbors that are not APs, phones, or cameras, and edits the site_data dict.
@@ -28,18 +108,10 @@ class cdpMasterDictHandler():
                 site_data[site]['device_scan_data'][cdp_neighbor] = {}
 
                 logger.debug(f"Beginning CDP neighbor-scan on {cdp_neighbor}")
-                cdp_device_data = scan_cdp_device(cdp_neighbor, username, password)
+                cdp_device_data = cdpMasterDictHandler.scan_device(cdp_neighbor, advertised_ips[site].get(cdp_neighbor, ''))
                 
                 logger.debug(f"CDP neighbor scan completed for {cdp_neighbor}. Adding data to its device_scan_data key entry.")
-                site_data[site]['device_scan_data'][cdp_neighbor]['ip_addr'] = cdp_device_data.ip_addr
-                site_data[site]['device_scan_data'][cdp_neighbor]['hostname'] = cdp_device_data.hostname
-                site_data[site]['device_scan_data'][cdp_neighbor]['dns_name'] = cdp_device_data.dns_name
-                site_data[site]['device_scan_data'][cdp_neighbor]['platform'] = cdp_device_data.platform
-                site_data[site]['device_scan_data'][cdp_neighbor]['stp_macaddress'] = cdp_device_data.stp_macaddress
-                site_data[site]['device_scan_data'][cdp_neighbor]['stp_blockedports'] = cdp_device_data.stp_blockedports
-                site_data[site]['device_scan_data'][cdp_neighbor]['serial_num'] = cdp_device_data.serial_num
-                site_data[site]['device_scan_data'][cdp_neighbor]['cdp_neighbors'] = cdp_device_data.cdp_neighbors
-                site_data[site]['device_scan_data'][cdp_neighbor]['scanned'] = cdp_device_data.scanned    
+                cdpMasterDictHandler.store_device_data(site_data, site, cdp_neighbor, cdp_device_data)
 
             elif cdp_neighbor in site_data[site]['device_scan_data'].keys(): # If the neighbor IS in the master_dict already
                 logger.debug(f"CDP neighbor {cdp_neighbor} found in device_scan_data keys. Evaluating 'scanned' flag.")
@@ -50,20 +122,153 @@ class cdpMasterDictHandler():
                 
                 else: # And the 'scanned' flag is set to FALSE...
                     logger.debug(f"'scanned' flag set to FALSE. Scanning neighbor.")
-                    cdp_device_data = scan_cdp_device(cdp_neighbor, username, password)
+                    cdp_device_data = cdpMasterDictHandler.scan_device(cdp_neighbor, advertised_ips[site].get(cdp_neighbor, ''))
 
                     logger.debug(f"CDP neighbor scan completed for {cdp_neighbor}. Adding data to its device_scan_data key entry.")
-                    site_data[site]['device_scan_data'][cdp_neighbor]['ip_addr'] = cdp_device_data.ip_addr
-                    site_data[site]['device_scan_data'][cdp_neighbor]['hostname'] = cdp_device_data.hostname
-                    site_data[site]['device_scan_data'][cdp_neighbor]['dns_name'] = cdp_device_data.dns_name
-                    site_data[site]['device_scan_data'][cdp_neighbor]['platform'] = cdp_device_data.platform
-                    site_data[site]['device_scan_data'][cdp_neighbor]['platform'] = cdp_device_data.platform
-                    site_data[site]['device_scan_data'][cdp_neighbor]['serial_num'] = cdp_device_data.serial_num
-                    site_data[site]['device_scan_data'][cdp_neighbor]['cdp_neighbors'] = cdp_device_data.cdp_neighbors
-                    site_data[site]['device_scan_data'][cdp_neighbor]['scanned'] = cdp_device_data.scanned         
+                    cdpMasterDictHandler.store_device_data(site_data, site, cdp_neighbor, cdp_device_data)
             
             pprint(site_data[site]['device_scan_data'][cdp_neighbor])
 
+    def scan_cdp_neighbors_concurrent(site_data, site, cdp_nei_scan_list):
+        """
+        This function is the concurrent version of scan_cdp_neighbors.
+
+        Every neighbor in the wave that still needs scanning is handed to a worker pool of at most cdp_scan_workers threads.
+        The workers only run scan_cdp_device; all edits to the site_data dict happen back on this thread, in scan-list order.
+        """
+
+        pending_neighbors = [] # Neighbors that need a scan, in the same order the serial path would scan them.
+        pending_set = set()
+
+        for cdp_neighbor in cdp_nei_scan_list:
+            if cdp_neighbor in pending_set:
+                continue
+
+            if cdp_neighbor in site_data[site]['device_scan_data'].keys():
+                if site_data[site]['device_scan_data'][cdp_neighbor]['scanned'] == True:
+                    logger.debug(f"'scanned' flag set to TRUE. Skipping neighbor {cdp_neighbor}")
+                    continue
+
+            pending_neighbors.append(cdp_neighbor)
+            pending_set.add(cdp_neighbor)
+
+        logger.debug(f"Submitting {len(pending_neighbors)} CDP neighbors to a pool of {cdp_scan_workers} workers.")
+
+        with ThreadPoolExecutor(max_workers=cdp_scan_workers) as executor:
+            scan_futures = {}
+            for cdp_neighbor in pending_neighbors:
+                scan_futures[cdp_neighbor] = executor.submit(cdpMasterDictHandler.scan_device, cdp_neighbor, advertised_ips[site].get(cdp_neighbor, ''))
+
+            for cdp_neighbor in pending_neighbors:
+                cdp_device_data = scan_futures[cdp_neighbor].result()
+
+                logger.debug(f"CDP neighbor scan completed for {cdp_neighbor}. Adding data to its device_scan_data key entry.")
+                cdpMasterDictHandler.store_device_data(site_data, site, cdp_neighbor, cdp_device_data)
+                pprint(site_data[site]['device_scan_data'][cdp_neighbor])
+
+    def scan_device(device, cdp_ip_addr=''):
+        """
+        This function runs scan_cdp_device on a single device while holding one of the run-wide SSH session slots.
+
+        The slots are shared by every site, so CDP-MAX-SSH-SESSIONS caps open sessions no matter how many sites are crawling.
+        cdp_ip_addr is the management IP the device's parent advertised over CDP. With CDP-CONNECT-MODE set to 'cdp-ip', the session is opened straight to it.
+        """
+        with ssh_session_limiter:
+            return(scan_cdp_device(device, username, password, cdp_ip_addr))
+
+    def plan_next_wave(site_data, site, frontier, visited_devices, ap_scan_list, queued_aps) -> list:
+        """
+        This function builds the scan list for the next discovery wave.
+
+        Only the devices scanned in the previous wave (the frontier) are walked, so every CDP neighbor entry is looked at once per site.
+        Switch-style neighbors are queued once through the visited_devices set, and APs are queued once through the queued_aps set.
+        The management IP each queued neighbor advertised over CDP is kept in advertised_ips, so the scan can connect to it without a DNS lookup.
+
+        Returns the list of CDP neighbors to scan in the next wave.
+        """
+        cdp_nei_scan_list = [] # This list will be used to store all devices that will be scanned like a switch or router. 
+
+        for device in frontier:
+            if site_data[site]['device_scan_data'][device]['platform'] == False: # The device failed SSH, so it has no neighbors to walk.
+                continue
+
+            for cdp_neighbor, cdp_neighbor_data in site_data[site]['device_scan_data'][device]['cdp_neighbors'].items():
+
+                if cdp_neighbor_data['is_ap'] == True:
+                    if cdp_neighbor in queued_aps:
+                        continue
+
+                    logger.debug(f"Adding CDP-Neighbor {cdp_neighbor} to AP scan_list due to AP flag set to TRUE")
+                    queued_aps.add(cdp_neighbor)
+                    ap_scan_list.append([device, cdp_neighbor]) # Use a tuple to track what device the AP is connected to. Collect data about all APs then pass to scan_cdp_AP_neighbor class outside of scan_depth loop.
+
+                elif cdp_neighbor_data['is_camera'] == False and cdp_neighbor_data['is_phone'] == False:
+                    if cdp_neighbor in visited_devices:
+                        continue
+
+                    logger.debug(f"Adding CDP-Neighbor {cdp_neighbor} to scan_list due to AP, camera, and phone flags set to FALSE")
+                    visited_devices.add(cdp_neighbor)
+                    cdp_nei_scan_list.append(cdp_neighbor)
+                    advertised_ips[site][cdp_neighbor] = cdp_neighbor_data['ip_addr']
+
+        return(cdp_nei_scan_list)
+
+    def scan_cdp_wave(site_data, site, cdp_nei_scan_list, wave):
+        """
+        This function scans one discovery wave, using the worker pool if CDP-SCAN-WORKERS is above 1, and records how long the wave took.
+        """
+        wave_start = time.perf_counter()
+
+        if os.environ.get('DNS-RESOLVE-MODE', 'per-host') == 'bulk': # Resolve the whole wave up front, so every device scan finds its name already in the DNS cache.
+            if os.environ.get('CDP-CONNECT-MODE', 'dns') == 'cdp-ip': # Only the devices that did not advertise an IP are resolved before their scan.
+                dns_resolve_hostname.resolve_bulk([cdp_neighbor for cdp_neighbor in cdp_nei_scan_list if advertised_ips[site].get(cdp_neighbor, '') == ''])
+            else:
+                dns_resolve_hostname.resolve_bulk(cdp_nei_scan_list)
+
+        if os.environ.get('SSH-PROBE-MODE', 'off') == 'tcp':
+            cdpMasterDictHandler.screen_wave(site_data, site, cdp_nei_scan_list)
+
+        if cdp_scan_workers > 1:
+            cdpMasterDictHandler.scan_cdp_neighbors_concurrent(site_data, site, cdp_nei_scan_list)
+        else:
+            cdpMasterDictHandler.scan_cdp_neighbors(site_data, site, cdp_nei_scan_list)
+
+        wave_seconds = time.perf_counter() - wave_start
+        wave_timings[site].append({'wave': wave, 'devices': len(set(cdp_nei_scan_list)), 'seconds': round(wave_seconds, 3)})
+        logger.info(f"Wave {wave} for site {site} covered {len(set(cdp_nei_scan_list))} CDP neighbors in {wave_seconds:.2f} seconds.")
+
+    def enrich_site_dns(site_data, site):
+        """
+        This function fills in dns_name for every device that was scanned through its CDP-advertised IP, in one bulk DNS batch per site.
+
+        Those devices skipped DNS before their SSH session, so the lookups happen here, after the crawl, instead of on every hop of it.
+        A device whose DNS record points somewhere other than the IP it advertised is logged, since one of the two is probably stale.
+        """
+        enrich_devices = []
+
+        for device, cdp_ip_addr in advertised_ips[site].items():
+            if cdp_ip_addr != '' and device in site_data[site]['device_scan_data'] and site_data[site]['device_scan_data'][device].get('dns_name') == '':
+                enrich_devices.append(device)
+
+        if len(enrich_devices) == 0:
+            return
+
+        dns_answers = dns_resolve_hostname.resolve_bulk(enrich_devices)
+
+        for device in enrich_devices:
+            dns_answer = dns_answers.get(device.lower().strip(), [])
+
+            if len(dns_answer) == 0:
+                logger.warning(f"{device} was scanned through its CDP-advertised IP {advertised_ips[site][device]}, but has no DNS record.")
+                continue
+
+            site_data[site]['device_scan_data'][device]['dns_name'] = device
+
+            if advertised_ips[site][device] not in dns_answer:
+                logger.warning(f"{device} advertised {advertised_ips[site][device]} over CDP, but DNS answers {dns_answer}.")
+
+        logger.info(f"Resolved {len(enrich_devices)} CDP-addressed devices for site {site} in one DNS batch.")
+
     def ssh_credential_test(username, password) -> bool:
     
         test_host = "TEST-HOST-IP-OR-FQDN-GOES-HERE"
@@ -77,7 +282,7 @@ class cdpMasterDictHandler():
 
         try:
             
-            with ConnectHandler(**credential_test_connection_details) as net_connect: 
+            with ssh_transport.connect(**credential_test_connection_details) as net_connect: 
                 net_connect.find_prompt()
                 time.sleep(1)
                 logger.info(f"Credential test on device {credential_test_connection_details['host']} successful. Proceeding with script.")
@@ -88,16 +293,103 @@ class cdpMasterDictHandler():
             logger.critical(e)
             return False
     
+    def discover_site_aps(site_data, site, ap_scan_list) -> list:
+        """
+        This function runs AP discovery for one site's APs and records how long it took.
+
+        Returns the list of APs that were not found on the wireless controllers.
+        """
+        stage_start = time.perf_counter()
+        ap_output = scan_cdp_AP_neighbor(site_data, site, ap_scan_list, username, password) # All discovered APs were added to the 'ap_scan_list' as a tuple with their corresponding switch as the opposite value in the tuple.
+        stage_timings[site]['ap_discovery'] = round(time.perf_counter() - stage_start, 3)
+
+        return(ap_output.unfound_aps)
+
+    def crawl_site(site_data, site):
+        """
+        This function runs the whole CDP crawl for a single site: the seed-device scan and every discovery wave, then hands the site's APs to AP discovery.
+
+        It only ever edits site_data[site], so several sites can be crawled at once on separate threads.
+        AP discovery runs on the AP discovery pool, so the next site's switch crawl can start while this site's APs are looked up on the controllers.
+
+        Returns the Future of the site's AP discovery. Its result is the list of APs that were not found on the wireless controllers.
+        """
+        site_data[site]['device_scan_data'] = {}
+
+        cdp_seed_device = site_data[site]['cdp_seed_device']
+        site_data[site]['device_scan_data'][cdp_seed_device] = {}
+        
+        #############################################################################
+        logger.debug(f"Beginning seed-device scan on {cdp_seed_device} for site {site}...")
+        print(f"Beginning seed-device scan on {cdp_seed_device} for site {site}...")
+
+        stage_start = time.perf_counter()
+        seed_device_data = cdpMasterDictHandler.scan_device(cdp_seed_device)
+        stage_timings[site]['seed'] = round(time.perf_counter() - stage_start, 3)
+        
+        print(f"Seed-device scan completed on {cdp_seed_device}.")
+        logger.debug(f"Seed-device scan completed on {cdp_seed_device}.")
+        #############################################################################
+        
+        cdpMasterDictHandler.store_device_data(site_data, site, cdp_seed_device, seed_device_data)
+
+        # At this point, the site's seed device is fully scanned and stored in the site_data dictionary. 
+        # Now, we can start looping through the seed device's CDP neighbors and scanning them. 
+        
+        ap_scan_list = [] # Since APs are scanned differently, we make a separate list for them. 
+        queued_aps = set() # APs already added to ap_scan_list, so each AP is only queried on the WLCs once.
+        visited_devices = set(site_data[site]['device_scan_data'].keys()) # Devices already scanned or queued for scanning at this site.
+        frontier = [cdp_seed_device] # Devices scanned in the previous wave. Only their neighbors can be new.
+        iter_count = 0
+        stage_start = time.perf_counter()
+        
+        logger.info(f"Scan depth set to {cdp_scan_depth}. This can be changed in the .env file.")
+        for _ in range(int(cdp_scan_depth) - 1 ): # The _ is a throwaway variable. Loop through the "range" of the cdp_scan_depth variable, but since it starts from 0, subtract 1 to equal user input.
+            
+            iter_count += 1 # Just for visually tracking the loop progress. Not needed for any other reason.
+            
+            print("\n" + ("*" * 80))
+            print(f"site {site} iter count: {iter_count}")
+            print(("*" * 80) + "\n")
+            
+            cdp_nei_scan_list = cdpMasterDictHandler.plan_next_wave(site_data, site, frontier, visited_devices, ap_scan_list, queued_aps)
+
+            if len(cdp_nei_scan_list) == 0: # Nothing new was discovered in the last wave, so deeper waves would find nothing either.
+                logger.info(f"No new CDP neighbors found for site {site} after wave {iter_count - 1}. Ending scan early.")
+                break
+            
+            cdpMasterDictHandler.scan_cdp_wave(site_data, site, cdp_nei_scan_list, iter_count)
+            frontier = cdp_nei_scan_list
+        
+        stage_timings[site]['waves'] = round(time.perf_counter() - stage_start, 3)
+
+        if os.environ.get('CDP-CONNECT-MODE', 'dns') == 'cdp-ip':
+            stage_start = time.perf_counter()
+            cdpMasterDictHandler.enrich_site_dns(site_data, site)
+            stage_timings[site]['dns_enrichment'] = round(time.perf_counter() - stage_start, 3)
+
+        return(ap_discovery_executor.submit(cdpMasterDictHandler.discover_site_aps, site_data, site, ap_scan_list))
+
     def __init__(self, site_data):
         
-        global master_dictionary, username, password, cdp_scan_depth, logger, failed_ssh_devices # This makes passing these variables into functions much easier.
+        global master_dictionary, username, password, cdp_scan_depth, cdp_scan_workers, ssh_session_limiter, ap_discovery_executor, logger, failed_ssh_devices, wave_timings, stage_timings, advertised_ips, unreachable_devices # This makes passing these variables into functions much easier.
 
         logger = myLogger(__name__)
 
         username = os.environ.get('SSH-USERNAME') # SSH username
         password = os.environ.get('SSH-PASSWORD') # SSH password 
         cdp_scan_depth = os.environ.get('CDP-SCAN-DEPTH') # This line can be edited to change how many levels deep you want CDP scanning to occur.
+        cdp_scan_workers = max(1, int(os.environ.get('CDP-SCAN-WORKERS', 1))) # How many devices of a wave are scanned at once. 1 keeps the original one-at-a-time scanning.
+        cdp_site_workers = max(1, int(os.environ.get('CDP-SITE-WORKERS', 1))) # How many sites are crawled at once. 1 crawls the sites one after another.
+        cdp_max_ssh_sessions = max(1, int(os.environ.get('CDP-MAX-SSH-SESSIONS', cdp_site_workers * cdp_scan_workers))) # Run-wide cap on open device SSH sessions across all sites.
+        ssh_session_limiter = threading.BoundedSemaphore(cdp_max_ssh_sessions)
+        ap_discovery_workers = max(1, int(os.environ.get('AP-DISCOVERY-WORKERS', 1))) # How many sites' AP batches are looked up on the controllers at once.
+        wave_timings = {}
+        stage_timings = {} # Seconds spent per site in the seed scan, the discovery waves, and AP discovery.
+        advertised_ips = {} # site -> {device: the management IP its parent advertised over CDP}.
+        unreachable_devices = {} # site -> {device: 'probe' or 'negative cache'}, for devices the reachability screen kept from being SSH'd into.
         failed_ssh_devices = []
+        unfound_aps_list = []
 
         if cdpMasterDictHandler.ssh_credential_test(username, password): # Runs credential_test function to ensure no accidental account lockouts if you typed your password in wrong.         
             logger.debug('SSH credential test has passed. Moving onto scanning functions.')
@@ -106,90 +398,83 @@ class cdpMasterDictHandler():
             
             for site in site_data.keys():
                 site_list.append(site)
+                wave_timings[site] = []
+                stage_timings[site] = {}
+                advertised_ips[site] = {}
+                unreachable_devices[site] = {}
 
-            for site in site_list:
-                
-                site_data[site]['device_scan_data'] = {}
+            logger.info(f"Crawling {len(site_list)} sites, {cdp_site_workers} at a time, with {cdp_scan_workers} workers per site and at most {cdp_max_ssh_sessions} SSH sessions open. AP discovery runs for {ap_discovery_workers} sites at a time.")
 
-                cdp_seed_device = site_data[site]['cdp_seed_device']
-                site_data[site]['device_scan_data'][cdp_seed_device] = {}
-                
-                #############################################################################
-                logger.debug(f"Beginning seed-device scan on {cdp_seed_device} for site {site}...")
-                print(f"Beginning seed-device scan on {cdp_seed_device} for site {site}...")
+            ap_discovery_executor = ThreadPoolExecutor(max_workers=ap_discovery_workers)
+            ap_futures = {}
 
-                seed_device_data = scan_cdp_device(cdp_seed_device, username, password)
-                
-                print(f"Seed-device scan completed on {cdp_seed_device}.")
-                logger.debug(f"Seed-device scan completed on {cdp_seed_device}.")
-                #############################################################################
-                
-                site_data[site]['device_scan_data'][cdp_seed_device]['ip_addr'] =          seed_device_data.ip_addr
-                site_data[site]['device_scan_data'][cdp_seed_device]['platform'] =         seed_device_data.platform
-                site_data[site]['device_scan_data'][cdp_seed_device]['serial_num'] =       seed_device_data.serial_num
-                site_data[site]['device_scan_data'][cdp_seed_device]['stp_macaddress'] =   seed_device_data.stp_macaddress
-                site_data[site]['device_scan_data'][cdp_seed_device]['stp_blockedports'] = seed_device_data.stp_blockedports
-                site_data[site]['device_scan_data'][cdp_seed_device]['cdp_neighbors'] =    seed_device_data.cdp_neighbors
-                site_data[site]['device_scan_data'][cdp_seed_device]['scanned'] =          seed_device_data.scanned
-
-                # At this point, the site's seed device is fully scanned and stored in the site_data dictionary. 
-                # Now, we can start looping through the seed device's CDP neighbors and scanning them. 
-                
-                ap_scan_list = [] # Since APs are scanned differently, we make a separate list for them. 
-                unfound_aps_list = []
-                iter_count = 0
-                
-                logger.info(f"Scan depth set to {cdp_scan_depth}. This can be changed in the .env file.")
-                for _ in range(int(cdp_scan_depth) - 1 ): # The _ is a throwaway variable. Loop through the "range" of the cdp_scan_depth variable, but since it starts from 0, subtract 1 to equal user input.
-                    
-                    iter_count += 1 # Just for visually tracking the loop progress. Not needed for any other reason.
-                    
-                    print("\n" + ("*" * 80))
-                    print(f"iter count: {iter_count}")
-                    print(("*" * 80) + "\n")
-                    
-                    cdp_nei_scan_list = [] # This list will be used to store all devices that will be scanned like a switch or router. 
-
-                    for device in site_data[site]['device_scan_data'].keys():
-                        if site_data[site]['device_scan_data'][device]['platform'] == False:
-                            continue
-
-                        else:
-                            for cdp_neighbor in site_data[site]['device_scan_data'][device]['cdp_neighbors'].keys():
-                            
-                                if site_data[site]['device_scan_data'][device]['cdp_neighbors'][cdp_neighbor]['is_ap'] == True:
-                                    logger.debug(f"Adding CDP-Neighbor {cdp_neighbor} to AP scan_list due to AP flag set to TRUE")
-                                    ap_scan_list.append([device, cdp_neighbor]) # Use a tuple to track what device the AP is connected to. Collect data about all APs then pass to scan_cdp_AP_neighbor class outside of scan_depth loop.
-
-                                elif site_data[site]['device_scan_data'][device]['cdp_neighbors'][cdp_neighbor]['is_ap'] == False:
-                                    if site_data[site]['device_scan_data'][device]['cdp_neighbors'][cdp_neighbor]['is_camera'] == False:
-                                        if site_data[site]['device_scan_data'][device]['cdp_neighbors'][cdp_neighbor]['is_phone'] == False:
-                                            logger.debug(f"Adding CDP-Neighbor {cdp_neighbor} to scan_list due to AP, camera, and phone flags set to FALSE")
-                                            cdp_nei_scan_list.append(cdp_neighbor)
-                    
-                    cdpMasterDictHandler.scan_cdp_neighbors(site_data, site, cdp_nei_scan_list)
-                
-                ap_output = scan_cdp_AP_neighbor(site_data, site, ap_scan_list, username, password) # All discovered APs were added to the 'ap_scan_list' as a tuple with their corresponding switch as the opposite value in the tuple.
-                for unfound_ap in ap_output.unfound_aps:
+            if cdp_site_workers > 1:
+                with ThreadPoolExecutor(max_workers=cdp_site_workers) as executor:
+                    site_futures = {}
+                    for site in site_list:
+                        site_futures[site] = executor.submit(cdpMasterDictHandler.crawl_site, site_data, site)
+
+                    for site in site_list:
+                        ap_futures[site] = site_futures[site].result()
+            
+            else:
+                for site in site_list:
+                    ap_futures[site] = cdpMasterDictHandler.crawl_site(site_data, site)
+
+            for site in site_list: # Wait for AP discovery to finish at every site, then log out of the pooled controller sessions.
+                for unfound_ap in ap_futures[site].result():
                     unfound_aps_list.append(unfound_ap)
 
+            ap_discovery_executor.shutdown()
+            scan_cdp_AP_neighbor.close_controller_sessions()
+
+        probe_failed_devices = [] # Failed a fresh TCP probe this run.
+        cache_skipped_devices = [] # Not probed at all, because they are still backing off in the negative cache.
+
         for site in site_data.keys():
             for device in site_data[site]['device_scan_data'].keys():
                 if site_data[site]['device_scan_data'][device]['platform'] == False:
                     failed_ssh_devices.append(device)
+
+                    if unreachable_devices.get(site, {}).get(device) == 'probe':
+                        probe_failed_devices.append(device)
+                    elif unreachable_devices.get(site, {}).get(device) == 'negative cache':
+                        cache_skipped_devices.append(device)
         
         if len(failed_ssh_devices) >= 1:
             logger.critical(f"""
             The following devices were unable to be SSH'd into. Please evaluate their connectivity and try scanning again:
 
             {failed_ssh_devices}
+
+            Of those, these failed a fresh probe of the SSH port this run:
+
+            {probe_failed_devices}
+
+            And these were skipped without a probe, because they failed recently and are still in the negative cache (SSH-NEGATIVE-CACHE-FILE):
+
+            {cache_skipped_devices}
             """)
         
         if len(unfound_aps_list) >= 1:
             logger.critical(f"""
-            The following APs were not found on either the 5k or the 9k controllers:
+            The following APs were not found on any of the wireless controllers:
 
             {unfound_aps_list}
             """)
 
+        logger.info(f"Opened {ssh_stats['connections']} device SSH sessions ({ssh_stats['cdp_ip_connections']} of them straight to a CDP-advertised IP), waited on {ssh_stats['command_round_trips']} interrogation round trips, ran {ssh_stats['mac_lookups']} per-port AP MAC lookups and {ssh_stats['mac_table_fetches']} bulk MAC table fetches over them.")
+
+        routed_aps = ap_discovery_stats['routed_aps']
+        logger.info(f"AP discovery sent {ap_discovery_stats['controller_queries']} controller queries. Learned controller affinity routed {routed_aps} APs: {ap_discovery_stats['affinity_hits']} hits, {ap_discovery_stats['affinity_misses']} misses ({ap_discovery_stats['affinity_hits'] / routed_aps if routed_aps else 0:.0%} hit rate).")
+        logger.info(f"The SSH reachability screen probed {reachability_stats['probed']} devices, {reachability_stats['unreachable']} of them unreachable, and skipped {reachability_stats['cache_skipped']} from the negative cache.")
+        logger.info(f"DNS cache answered {dns_stats['hits']} lookups ({dns_stats['negative_hits']} of them negative) and sent {dns_stats['misses']} queries to the nameserver.")
+
         self.site_data_dict = site_data
+        self.wave_timings = wave_timings
+        self.stage_timings = stage_timings
+        self.ssh_stats = dict(ssh_stats)
+        self.ap_discovery_stats = dict(ap_discovery_stats)
+        self.dns_stats = dict(dns_stats)
+        self.reachability_stats = dict(reachability_stats)
+        self.failed_ssh_devices = {'all': failed_ssh_devices, 'probe_failed': probe_failed_devices, 'cache_skipped': cache_skipped_devices}
@@ -0,0 +1,92 @@
+import re
+import sys
+
+from cdp_records import NeighborRecord
+
+cdp_line_regex = re.compile(r"""
+    \n(?:
+        (?P<separator>-{10,})
+        |Device\ ID:[ \t]*(?P<device_id>[^\n]*[^\s])
+        |[ \t]*IP(?:v4)?\ [Aa]ddress:[ \t]*(?P<ip_addr>[0-9.]+)
+        |Platform:[ \t]*(?:cisco[ \t]+)?(?P<platform>[^,\n]+),[ \t]+Capabilities:[ \t]*(?P<capabilities>[^\n]*)
+        |Interface:[ \t]*(?P<local_port>[^,\n]+),[ \t]+Port\ ID\ \(outgoing\ port\):[ \t]*(?P<remote_port>[^\n]*[^\s])
+    )
+    """, re.VERBOSE) # Every alternative starts with the newline and uses greedy, non-backtracking field patterns, so the engine skips quickly from line to line.
+
+class cdp_parser():
+    """
+    This class parses raw CDP output in a single pass over the text, using one precompiled pattern.
+
+    It understands both 'show cdp entry *' and 'show cdp neighbors detail', including NX-OS style 'Device ID:name(SERIAL)' and 'IPv4 Address:' lines.
+    """
+
+    def clean_device_id(device_id) -> str:
+        """
+        This function strips NX-OS '(SERIAL)' suffixes and '.domain.com' suffixes from a CDP Device ID.
+        """
+        device_id = device_id.split('(')[0]
+
+        if '.' in device_id: # Filters out '.domain.com' suffixes
+            device_id = device_id.split('.')[0]
+
+        return(device_id)
+
+    def parse(cdp_output) -> list:
+        """
+        This function turns raw CDP output into a list of NeighborRecord objects, one per neighbor entry.
+
+        Entries are split on the dashed separator lines. Anything before the first separator, and any entry without a Device ID, is dropped.
+        When an entry lists more than one IP address, the last one (the management address) is kept.
+        """
+        cdp_output = "\n" + cdp_output
+        check_cameras = "Network Camera" in cdp_output # Cameras can say so on any line, so entries are only searched for it when the output mentions one at all.
+
+        neighbor_records = []
+        record = None # The entry currently being filled in. None until the first separator is seen.
+        record_start = 0
+
+        for line_match in cdp_line_regex.finditer(cdp_output):
+            field = line_match.lastgroup
+
+            if field == 'separator':
+                if record is not None:
+                    cdp_parser.finish_record(record, neighbor_records, check_cameras and "Network Camera" in cdp_output[record_start:line_match.start()])
+                record = NeighborRecord('')
+                record_start = line_match.end()
+
+            elif record is None:
+                continue
+
+            elif field == 'device_id':
+                record.device_id = cdp_parser.clean_device_id(line_match.group('device_id'))
+
+            elif field == 'ip_addr':
+                record.ip_addr = line_match.group('ip_addr')
+
+            elif field == 'capabilities':
+                record.platform = sys.intern(line_match.group('platform')) # Interned here, since the record is filled in field by field instead of through NeighborRecord's constructor.
+                capabilities = line_match.group('capabilities')
+
+                if "Trans-Bridge" in capabilities:
+                    record.is_ap = True
+                if capabilities.startswith("Host Phone"):
+                    record.is_phone = True
+
+            elif field == 'remote_port':
+                record.local_port = sys.intern(line_match.group('local_port'))
+                record.remote_port = sys.intern(line_match.group('remote_port'))
+
+        if record is not None:
+            cdp_parser.finish_record(record, neighbor_records, check_cameras and "Network Camera" in cdp_output[record_start:])
+
+        return(neighbor_records)
+
+    def finish_record(record, neighbor_records, is_camera):
+        """
+        This function closes out a parsed entry and keeps it if it had a Device ID.
+        """
+        if record.device_id == '':
+            return
+
+        record.is_camera = is_camera
+        neighbor_records.append(record)
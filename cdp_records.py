@@ -0,0 +1,135 @@
+import sys
+
+class crawl_record():
+    """
+    Shared behaviour for the compact crawl records.
+
+    Records keep their fields in __slots__ instead of a per-instance dict, and still answer record['field'] like the nested dicts they replace,
+    so code that reads site_data keeps working unchanged. Fields that were never set are left out of to_dict(), just like a missing dict key.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return(getattr(self, key))
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key) -> bool:
+        return(hasattr(self, key))
+
+    def get(self, key, default=None):
+        return(getattr(self, key, default))
+
+    def keys(self) -> list:
+        return([field for field in self.__slots__ if hasattr(self, field)])
+
+    def __repr__(self) -> str:
+        return(repr(self.to_dict()))
+
+class NeighborRecord(crawl_record):
+    """
+    One CDP neighbor entry, as parsed from 'show cdp entry *' or 'show cdp neighbors detail'.
+
+    Every field starts from its default for each entry, so nothing can carry over from the previous neighbor.
+    Platform and port names repeat across thousands of neighbors, so they are interned and every record shares one copy.
+    The constructor interns them; code that sets them afterwards (like cdp_parser) must intern them itself.
+    """
+    __slots__ = ('device_id', 'remote_port', 'local_port', 'ip_addr', 'platform', 'is_ap', 'is_phone', 'is_camera', 'scanned', 'ap_macaddress')
+
+    def to_dict(self) -> dict:
+        """
+        Returns the neighbor in the same shape the cdp_neighbors dict has always used in the dump.
+        """
+        neighbor_dict = {
+            'remote_port': self.remote_port,
+            'local_port': self.local_port,
+            'ip_addr': self.ip_addr,
+            'platform': self.platform,
+            'is_ap': self.is_ap,
+            'is_phone': self.is_phone,
+            'is_camera': self.is_camera,
+            'scanned': self.scanned,
+        }
+
+        if self.is_ap:
+            neighbor_dict['ap_macaddress'] = self.ap_macaddress
+
+        return(neighbor_dict)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, NeighborRecord):
+            return(NotImplemented)
+        return(self.device_id == other.device_id and self.to_dict() == other.to_dict())
+
+    def __init__(self, device_id, remote_port='', local_port='', ip_addr='', platform='', is_ap=False, is_phone=False, is_camera=False, scanned=False, ap_macaddress=None):
+        self.device_id = device_id
+        self.remote_port = sys.intern(remote_port)
+        self.local_port = sys.intern(local_port)
+        self.ip_addr = ip_addr
+        self.platform = sys.intern(platform)
+        self.is_ap = is_ap
+        self.is_phone = is_phone
+        self.is_camera = is_camera
+        self.scanned = scanned
+        self.ap_macaddress = ap_macaddress # Only filled in for APs.
+
+class DeviceRecord(crawl_record):
+    """
+    One scanned device in site_data[site]['device_scan_data'], holding its cdp_neighbors as NeighborRecord objects.
+
+    mac_table is only set when a bulk MAC table was pulled, so it only shows up in the dump for those devices.
+    """
+    __slots__ = ('ip_addr', 'hostname', 'dns_name', 'platform', 'stp_macaddress', 'stp_blockedports', 'serial_num', 'cdp_neighbors', 'scanned', 'mac_table')
+
+    def to_dict(self) -> dict:
+        """
+        Returns the device in the same shape the device_scan_data dict has always used in the dump.
+        """
+        device_dict = {}
+
+        for field in self.keys():
+            device_dict[field] = getattr(self, field)
+
+        if isinstance(device_dict.get('cdp_neighbors'), dict):
+            device_dict['cdp_neighbors'] = {device_id: neighbor.to_dict() for device_id, neighbor in device_dict['cdp_neighbors'].items()}
+
+        return(device_dict)
+
+    def from_scan(cdp_device_data):
+        """
+        Builds a DeviceRecord from a finished scan_cdp_device instance.
+        """
+        device_record = DeviceRecord()
+        device_record.ip_addr = cdp_device_data.ip_addr
+        device_record.hostname = cdp_device_data.hostname
+        device_record.dns_name = cdp_device_data.dns_name
+        device_record.platform = sys.intern(cdp_device_data.platform) if isinstance(cdp_device_data.platform, str) else cdp_device_data.platform
+        device_record.stp_macaddress = cdp_device_data.stp_macaddress
+        device_record.stp_blockedports = cdp_device_data.stp_blockedports
+        device_record.serial_num = cdp_device_data.serial_num
+        device_record.cdp_neighbors = cdp_device_data.cdp_neighbors
+        device_record.scanned = cdp_device_data.scanned
+
+        if cdp_device_data.mac_table: # Only present when CDP-MAC-TABLE-MODE is 'bulk' and the device has APs. Kept for later MAC correlation.
+            device_record.mac_table = cdp_device_data.mac_table
+
+        return(device_record)
+
+def serialize_site_data(site_data) -> dict:
+    """
+    This function turns site_data into plain dicts and lists, in the same YAML/JSON shape the dump has always had.
+    """
+    if isinstance(site_data, crawl_record):
+        return(site_data.to_dict())
+
+    if isinstance(site_data, dict):
+        return({key: serialize_site_data(value) for key, value in site_data.items()})
+
+    if isinstance(site_data, list):
+        return([serialize_site_data(value) for value in site_data])
+
+    return(site_data)
@@ -1,10 +1,31 @@
 import os
 import re
+import time
+import threading
 import pynetbox
 
 from pprint import pprint
-from logger import myLogger
+from logger import myLogger, lazyLogger
 from dotenv import load_dotenv
+from persistent_cache import persistent_cache
+
+nb = None # One Netbox API client, shared by every integrity check and by netbox_data_handler for the whole run.
+nb_lock = threading.Lock()
+loc_dict = None # The site -> location -> rack index, built on the first integrity check and shared by the rest of the run.
+loc_dict_lock = threading.Lock()
+
+hostname_fields = { # The naming standard, by number of hyphenated fields. Example 4-field name: ch-fl01-nr01-sw01. Example 5-field name: ch-fl01-nr01-sw01-mgmt.
+    4: ('site', 'location', 'rack', 'device'),
+    5: ('site', 'location', 'rack', 'device', 'qualifier'), # The original checker accepted 5 fields but never defined the fifth. It is assumed to be a free-form tag; see the README's hostname standard.
+}
+
+dns_verdict_stats = {'cached': 0, 'fresh': 0} # Run-wide counts of dns_check verdicts reused from the verdict cache vs. worked out from DNS.
+dns_verdict_lock = threading.Lock()
+
+field_regexes = { # Compiled once, for the fields that are checked by pattern instead of against Netbox. The whole field must match (fullmatch).
+    'device': re.compile(r"(sw|ds|rt|ap)\d\d"), # Examples: sw01, ds01, rt02, ap12, etc.
+    'qualifier': re.compile(r"[a-z0-9]+"), # Assumed, not from the original standard. Examples: mgmt, oob, 2.
+}
 
 class data_integrity_check():
     
@@ -12,6 +33,60 @@ class data_integrity_check():
         """
         This function takes in a hostname and an IP address, then checks DNS for accuracy.
 
+        Returns [RESULT, error_message], the same as verify_dns. A verdict already reached for the same hostname and IP is reused; see dns_check_verdict.
+        """
+        dns_result, error_message, verdict_source = data_integrity_check.dns_check_verdict(hostname, ip_addr)
+        return(dns_result, error_message)
+
+    def open_verdict_cache():
+        """
+        This function opens the DNS verdict cache, kept in DNS-VERDICT-CACHE-FILE. An empty DNS-VERDICT-CACHE-FILE keeps it in memory for this run only.
+        """
+        return(persistent_cache.open(
+            os.environ.get('DNS-VERDICT-CACHE-FILE', '') or ':memory:',
+            'dns_verdicts',
+            float(os.environ.get('DNS-VERDICT-TTL', 3600)), # Seconds. A fixed DNS record is re-verified at the latest this long after its last verdict.
+        ))
+
+    def dns_check_verdict(hostname, ip_addr) -> tuple:
+        """
+        This function returns the DNS verdict for a hostname and IP pair, running verify_dns only if there is no unexpired verdict for the pair yet.
+
+        Verdicts are shared by every device in the run and, with DNS-VERDICT-CACHE-FILE set, kept between runs, so unchanged devices skip DNS entirely.
+        A verdict is only cached when every lookup behind it got a real answer from DNS. One reached while a lookup failed (e.g. timed out) is returned but not cached,
+        so a passing resolver problem does not mark a good device as a DNS failure until the verdict expires.
+
+        Returns [RESULT, error_message, verdict_source]. verdict_source is 'cached' or 'fresh'.
+        """
+        verdict_cache = data_integrity_check.open_verdict_cache()
+        cached_verdict = verdict_cache.get((hostname, ip_addr))
+
+        if cached_verdict != None:
+            with dns_verdict_lock:
+                dns_verdict_stats['cached'] += 1
+
+            logger.debug(f"Reused the DNS verdict for {hostname}, {ip_addr}: {cached_verdict}")
+            return(cached_verdict[0], cached_verdict[1], 'cached')
+
+        failed_lookups = set()
+        dns_result, error_message = data_integrity_check.verify_dns(hostname, ip_addr, failed_lookups)
+
+        if len(failed_lookups) == 0:
+            verdict_cache.put((hostname, ip_addr), [dns_result, error_message])
+        else:
+            logger.warning(f"Not caching the DNS verdict for {hostname}, {ip_addr}: the lookups for {sorted(failed_lookups)} failed.")
+
+        with dns_verdict_lock:
+            dns_verdict_stats['fresh'] += 1
+
+        return(dns_result, error_message, 'fresh')
+
+    def verify_dns(hostname, ip_addr, failed_lookups=None) -> tuple:
+        """
+        This function takes in a hostname and an IP address, then checks DNS for accuracy, always asking DNS. Most callers want dns_check, which reuses earlier verdicts.
+
+        Pass a set as failed_lookups to have every name or IP whose lookup failed (rather than answered) added to it; see dns_resolve_hostname.dns_reporter.
+
         Returns [RESULT, error_message]
 
         The RESULT indicates that all DNS checks return TRUE:
@@ -33,7 +108,7 @@ class data_integrity_check():
             The IP must resolve to a single hostname, and the hostname must match the original hostname. 
             """
             hostname_dns_type = dns_resolve_hostname.dns_determiner(hostname)
-            hostname_dns_output = dns_resolve_hostname.dns_reporter(hostname, hostname_dns_type)    
+            hostname_dns_output = dns_resolve_hostname.dns_reporter(hostname, hostname_dns_type, failed_lookups)    
 
             if len(hostname_dns_output) == 1: # A single DNS entry is found for the given hostname. This is the desired outcome. 
                 hostname_answer = hostname_dns_output[0] # This gives us the IP address found in DNS for the hostname. 
@@ -41,7 +116,7 @@ class data_integrity_check():
                 logger.debug(f"DNS answer found for {hostname}: {hostname_answer}")
 
                 hostname_reversion_check = dns_resolve_hostname.dns_determiner(hostname_answer) # This takes the IP address we found, and resolves it to check if it matches the original hostname. 
-                hostname_reversion_check = dns_resolve_hostname.dns_reporter(hostname_answer, hostname_reversion_check)
+                hostname_reversion_check = dns_resolve_hostname.dns_reporter(hostname_answer, hostname_reversion_check, failed_lookups)
 
                 # print(f"DEBUG: {hostname_reversion_check}")
 
@@ -53,7 +128,7 @@ class data_integrity_check():
                     # print(f"DEBUG-FAILURE: {hostname_reversion_check}")
                     hostname_reversion_check = False
 
-                print(f"Hostname: {hostname} Reversion_check: {hostname_reversion_check}")
+                logger.debug(f"Hostname: {hostname} Reversion_check: {hostname_reversion_check}")
 
                 if hostname_reversion_check == hostname:
                     return([hostname_answer, True])
@@ -62,13 +137,11 @@ class data_integrity_check():
 
             elif len(hostname_dns_output) > 1: # Multiple DNS entries detected for the given hostname. 
                 hostname_answer = hostname_dns_output
-                print(f"Multiple DNS entries found for hostname {hostname}: {hostname_answer}")
                 logger.error(f"Multiple DNS entries found for hostname {hostname}: {hostname_answer}")
                 return(hostname_answer, False)
                 
             else: # No DNS entries found for the given hostname. 
                 hostname_answer = 'NOTFOUND'
-                print(f"No DNS entry found for hostname {hostname}")
                 logger.error(f"No DNS entry found for hostname {hostname}")
                 return(hostname_answer, False)
         
@@ -79,7 +152,7 @@ class data_integrity_check():
             # print(f"DEBUG: {ip_addr}")
             ip_dns_type = dns_resolve_hostname.dns_determiner(ip_addr) # Gives us the hostname(s) associated with the IP in DNS. 
             # print(f"DEBUG: {ip_dns_type}")
-            ip_dns_output = dns_resolve_hostname.dns_reporter(ip_addr, ip_dns_type)
+            ip_dns_output = dns_resolve_hostname.dns_reporter(ip_addr, ip_dns_type, failed_lookups)
             
             # print(f"DEBUG: {ip_dns_output}")
             if len(ip_dns_output) >= 1: # A single DNS entry is found for the given hostname. This is the desired outcome. 
@@ -88,13 +161,12 @@ class data_integrity_check():
                 if '.' in ip_answer: 
                     ip_answer = ip_answer.split('.')[0]
                 # print(f"DEBUG2: {ip_answer}")
-                print(f"DNS answer found for IP {ip_addr}: {ip_answer}")
                 logger.debug(f"DNS answer found for IP {ip_addr}: {ip_answer}")
 
                 ip_reversion_check = dns_resolve_hostname.dns_determiner(ip_answer) # This takes the hostname we found, and resolves it to check if it matches the original hostname. 
-                ip_reversion_check = dns_resolve_hostname.dns_reporter(ip_answer, ip_reversion_check)
+                ip_reversion_check = dns_resolve_hostname.dns_reporter(ip_answer, ip_reversion_check, failed_lookups)
                 
-                print(f"IP: {ip_addr} Reversion_check: {ip_reversion_check[0]}")
+                logger.debug(f"IP: {ip_addr} Reversion_check: {ip_reversion_check}")
                 
                 if len(ip_reversion_check) >= 1:
                     # if '.' in ip_reversion_check[0]:
@@ -126,20 +198,19 @@ class data_integrity_check():
                 else: # This is used if there are many values in the returned hostname check.
                     ip_reversion_check = False
                 
+                return(ip_answer, False) # The name the IP resolves to does not resolve back to the IP.
                 
             else: # No DNS entries found for the given hostname. 
                 ip_answer = 'NOTFOUND'
-                print(f"No DNS entry found for hostname {hostname}")
                 logger.error(f"No DNS entry found for hostname {hostname}")
                 return(ip_answer, False)
         
-        print(f"Checking {hostname}, {ip_addr}")
+        logger.debug(f"Checking {hostname}, {ip_addr}")
         hostname_answer, hostname_dns_integrity = hostname_check(hostname)
         
         if len(ip_addr) >= 1:
             ip_answer, ip_dns_integrity = ip_check(ip_addr)
         else:
-            print(f"No IP address provided for hostname {hostname}")
             logger.critical(f"No IP address provided for hostname {hostname}")
             ip_answer, ip_dns_integrity = 'NOTPROVIDED', False
 
@@ -155,28 +226,23 @@ class data_integrity_check():
                 if hostname_dns_integrity == True:
                     if ip_dns_integrity == True:
                         error_message = 'NONE'
-                        print(f"DNS successfully validated, all values look good. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
                         logger.debug(f"DNS successfully validated, all values look good. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
                         return(True, error_message)
 
                     else: 
                         error_message = 'ip_dns_integrity == FALSE'
-                        print(f"IP DNS integrity is FALSE. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
                         logger.error(f"IP DNS integrity is FALSE. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
                         return(False, error_message)
                 else:
                     error_message = 'hostname_dns_integrity == FALSE'
-                    print(f"Hostname DNS integrity is FALSE. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
                     logger.error(f"Hostname DNS integrity is FALSE. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
                     return(False, error_message)
             else:
                 error_message = 'dns_ip_answer != hostname'
-                print(f"DNS IP answer != provided hostname. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
                 logger.error(f"DNS IP answer != provided hostname. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
                 return(False, error_message)
         else:
             error_message = "dns_hostname_answer != ip_addr"
-            print(f"DNS Hostname answer != provided IP addr. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
             logger.error(f"DNS Hostname answer != provided IP addr. Details: PROVIDED_HOSTNAME: {hostname} , PROVIDED_IP_ADDR: {ip_addr} , HOSTNAME_DNS_ANSWER: {hostname_answer} , IP_DNS_ANSWER: {ip_answer}")
             return(False, error_message)
 
@@ -191,148 +257,118 @@ class data_integrity_check():
             - Each hyphenated field matches its specific regex
 
         The error_message indicates what issue is found, so other scripts can take corrective action.
+
+        This is the single-host form of validate_hostnames. Use that one to check a whole site or inventory at once.
         """
-    # --- Defining a few starter variables. --- #
+        hostname_result = data_integrity_check.validate_hostnames([hostname], site)[hostname]
 
-        name_hyphen_check = hostname.split("-")
-        hyphen_check_bool = False # Used for checking how many hyphenated fields are in the name. 
-        name_test_bool = False # Used for checking each of the hyphenated fields in the name for accuracy. 
+        if hostname_result['result'] == True:
+            logger.debug(f"Hostname {hostname} passed hostname_check.")
+        else:
+            logger.error(f"Hostname {hostname} failed hostname_check. Details: {hostname_result['error_message']}")
 
-    # --- This section is for checking hyphenated fields --- #
+        return(hostname_result['result'], hostname_result['error_message'])
 
-        if len(name_hyphen_check) <= 3:
-            # print(f"Name {hostname} fails due to not enough hyphenated fields.")
-            error_message = 'not_enough_fields'
-            logger.error(f"Hostname {hostname} failed hostname_check. Details: {error_message}")
-            hyphen_check_bool = False
+    def validate_hostname(hostname, site, location_set, rack_set) -> dict:
+        """
+        This function checks one hostname against the naming grammar (hostname_fields), field by field.
 
-        if len(name_hyphen_check) == 4 or len(name_hyphen_check) == 5:
-            # print(f"Name {hostname} succeeds number of hyphenated fields.")
-            error_message = "None"
-            logger.debug(f"Hostname {hostname} succeeded hyphenated-fields hostname_check.")
-            hyphen_check_bool = True
-        
-        if len(name_hyphen_check) >= 6:
-            # print(f"Name {hostname} fails due to too many hyphenated fields.")
-            error_message = 'too_many_fields'
-            logger.error(f"Hostname {hostname} failed hostname_check. Details: {error_message}")
-            hyphen_check_bool = False
-        
-    # --- This section is for checking the hostname to see if it matches a regex check --- # 
+        Returns the hostname's row for validate_hostnames: {'hostname', 'site', 'result', 'error_message', 'fields', 'failed_fields'}.
+        error_message describes the first field that failed, or is 'pass'.
+        """
+        name_fields = hostname.split("-")
+        hostname_result = {'hostname': hostname, 'site': site, 'result': False, 'error_message': 'pass', 'fields': {}, 'failed_fields': []}
+
+        if len(name_fields) < min(hostname_fields.keys()):
+            hostname_result['error_message'] = 'not_enough_fields'
+            return(hostname_result)
+
+        if len(name_fields) > max(hostname_fields.keys()):
+            hostname_result['error_message'] = 'too_many_fields'
+            return(hostname_result)
+
+        for field_number, (field_name, field_value) in enumerate(zip(hostname_fields[len(name_fields)], name_fields), start=1):
+            hostname_result['fields'][field_name] = field_value
+
+            if field_name == 'site':
+                field_check, field_error = field_value == site, 'field1 does not match site_name'
+            elif field_name == 'location':
+                field_check, field_error = field_value in location_set, f'field{field_number} does not match any locations for its site'
+            elif field_name == 'rack':
+                field_check, field_error = field_value in rack_set, f'field{field_number} does not match any netracks for its location'
+            else:
+                field_check, field_error = field_regexes[field_name].fullmatch(field_value) != None, f'field{field_number} does not match regex pattern'
 
-        if hyphen_check_bool == True: # If the name passes the hyphenated fields check, we can start our regex check on it. 
-            
-            site = site # Redundantly defined here for better visibility. 
-            location_list = [] # If a matching site is found, another API call to Netbox to retrieve only the potential buildings for that site in Netbox            
-            rack_list = [] # If matching locations are found, pull all the netracks associated with that location. 
-                
-            for loc in loc_dict[site]['locations'].keys():
-                location_list.append(loc)
+            if field_check == False:
+                hostname_result['failed_fields'].append(field_name)
 
-                for rack in loc_dict[site]['locations'][loc]['netracks'].keys():
-                    rack_list.append(rack)
-            
-            if len(name_hyphen_check) == 4: # Example hostname: ch-fl01-nr01-sw01
-                
-                field1, field1_check = name_hyphen_check[0], False # ch
-                field2, field2_check = name_hyphen_check[1], False # fl01
-                field3, field3_check = name_hyphen_check[2], False # nr01
-                field4, field4_check = name_hyphen_check[3], False # sw01
-
-            # --- Checking the first hyphenated field to see if it matches its site. --- # 
-                if field1 == site:
-                    field1_check = True
-                    if error_message == "None":
-                        error_message = "None"
-                else:
-                    if error_message == "None":
-                        error_message = f"Hostname {hostname} failed field1 check: field1 does not match site_name"
-                    else:
-                        error_message = error_message
-                
-            # --- Checking the second hyphenated field to see if it matches its site's locations. --- #
-                if field2 in location_list:
-                    field2_check = True
-                    if error_message == "None":
-                        error_message = 'None'
-                else:
-                    if error_message == "None":
-                        error_message = f"Hostname {hostname} failed field2 check: field2 does not match any locations for its site"
-                    else:
-                        error_message = error_message
+                if hostname_result['error_message'] == 'pass':
+                    hostname_result['error_message'] = f"Hostname {hostname} failed field{field_number} check: {field_error}"
 
-            # --- Checking the third hyphenated field to see if it matches its location's netracks. --- #
-                if field3 in rack_list:
-                    field3_check = True
-                    if error_message == "None":
-                        error_message = 'None'
-                else:
-                    if error_message == "None":
-                        error_message = f"Hostname {hostname} failed field3 check: field3 does not match any netracks for its location"
-                    else:
-                        error_message = error_message
-
-            # --- Checking the fourth hyphenated field to see if it matches a simple regex for the device type + number. --- # 
-                regex_pattern = "sw|ds|rt|ap\d\d" # Examples: sw01, ds01, rt02, ap12, etc. 
-                if re.match(regex_pattern, field4):
-                    field4_check = True
-                    if error_message == "None":
-                        error_message = 'None'
-                else:
-                    if error_message == "None":
-                        error_message = f"Hostname {hostname} failed field4 check: field4 does not match regex pattern"
-                    else:
-                        error_message = error_message
-                
-            # --- Final evaluation of all checks. --- # 
-                if field1_check == True:
-                    if field2_check == True:
-                        if field3_check == True:
-                            if field4_check == True:
-                                return(True, 'pass')
-                            else:
-                                return(False, error_message)
-                        else:
-                            return(False, error_message)
-                    else:
-                        return(False, error_message)
-                else:
-                    return(False, error_message)
+        hostname_result['result'] = len(hostname_result['failed_fields']) == 0
 
-            # if len(name_hyphen_check) == 5:
-            #     if len(name_hyphen_check) == 4:
-                
-            #         field1, field1_check = name_hyphen_check[0], False
-            #         field2, field2_check = name_hyphen_check[1], False
-            #         field3, field3_check = name_hyphen_check[2], False
-            #         field4, field4_check = name_hyphen_check[3], False
-            #         field5, field5_check = name_hyphen_check[4], False
-
-            #         if field1 == site:
-            #             field1_check = True
-            #             field1_error_message = 'None'
-            #         else:
-            #             field1_error_message = f"Hostname {hostname} failed field1 check -- field1 does not match any site"
-                    
-            #         if field2 in location_list:
-            #             field2_check = True
-            #             field2_error_message = 'None'
-            #         else:
-            #             field2_error_message = f"Hostname {hostname} failed field2 check -- field2 does not match any location for its site"
-
-            #         if field3 in rack_list:
-            #             field3_check = True
-            #             field3_error_message = 'None'
-            #         else:
-            #             field3_error_message = f"Hostname {hostname} failed field3 check -- field3 does not match any netrack for its location"
-        
-        elif hyphen_check_bool == False: # If the name fails, return the specific fail message. 
-            
-            return(False, error_message)
+        return(hostname_result)
+
+    def validate_hostnames(hostnames, site=None) -> dict:
+        """
+        This function checks a whole batch of hostnames against the naming standard in one pass, e.g. every device of a site or every device in Netbox.
+
+        hostnames is either a list of names that all belong to site, or a {hostname: site} dict for names from many sites.
+        The grammar is compiled once at import, and each site's locations and racks come from the shared location index, so every name costs a few set lookups.
+
+        Returns {hostname: row}, with one row per hostname as described in validate_hostname.
+        """
+        if not isinstance(hostnames, dict):
+            hostnames = {hostname: site for hostname in hostnames}
+
+        site_locations = loc_dict if loc_dict != None else data_integrity_check.load_site_locations()
+        validate_start = time.perf_counter()
+        hostname_results = {}
+
+        for hostname, hostname_site in hostnames.items():
+            location_set = site_locations[hostname_site]['location_set'] if hostname_site in site_locations else set()
+            rack_set = site_locations[hostname_site]['rack_set'] if hostname_site in site_locations else set()
+
+            hostname_results[hostname] = data_integrity_check.validate_hostname(hostname, hostname_site, location_set, rack_set)
+
+        if len(hostname_results) > 1:
+            failed_count = len([hostname for hostname in hostname_results.keys() if hostname_results[hostname]['result'] == False])
+            logger.info(f"Validated {len(hostname_results)} hostnames in {time.perf_counter() - validate_start:.2f} seconds: {len(hostname_results) - failed_count} passed, {failed_count} failed.")
+
+        return(hostname_results)
+
+    def audit_netbox_hostnames() -> dict:
+        """
+        This function checks the name of every device in Netbox against the naming standard, with each device checked against its own site.
+
+        Returns the validate_hostnames result table. Devices without a name are left out.
+        """
+        data_integrity_check.connect_netbox()
+
+        netbox_hostnames = {}
+        for device in nb.dcim.devices.all():
+            if device.name != None and device.site != None:
+                netbox_hostnames[device.name] = device.site.slug
+
+        return(data_integrity_check.validate_hostnames(netbox_hostnames))
+
+    def location_field(location_slug) -> str:
+        """
+        This function turns a Netbox location slug into the location field used in hostnames, e.g. 'ch-fl01' -> 'fl01'.
+        """
+        return(location_slug.split("-")[1] if "-" in location_slug else location_slug)
+
+    def rack_field(rack_name) -> str:
+        """
+        This function turns a Netbox rack name into the rack field used in hostnames, e.g. 'ch-fl01-nr01' or 'nr01' -> 'nr01'.
+        """
+        return(rack_name.split("-")[-1])
 
     def compile_site_locations() -> dict:
         """
         This function retrieves all sites and their respective locations from Netbox, then stores them in a usable dictionary. 
+
+        Locations and racks are both keyed by the field they fill in a hostname, so a rack is filed under the same location key its location got.
         """
         sites = nb.dcim.sites.all()
         locations = nb.dcim.locations.all()
@@ -347,30 +383,91 @@ class data_integrity_check():
         for loc in locations:
             if loc.site.slug in loc_dict.keys():
                 
-                loc_name = loc.slug
-                loc_name = loc_name.split("-")[1]
+                loc_name = data_integrity_check.location_field(loc.slug)
 
                 loc_dict[loc.site.slug]['locations'][loc_name] = {}
                 loc_dict[loc.site.slug]['locations'][loc_name]['netracks'] = {}
 
         for rack in netracks:
-            if rack.site.slug in loc_dict.keys():
-                if rack.location.slug in loc_dict[rack.site.slug]['locations'].keys():
-                    loc_dict[rack.site.slug]['locations'][rack.location.slug]['netracks'][rack] = {}
+            if rack.site.slug in loc_dict.keys() and rack.location != None:
+                loc_name = data_integrity_check.location_field(rack.location.slug)
+
+                if loc_name in loc_dict[rack.site.slug]['locations'].keys():
+                    loc_dict[rack.site.slug]['locations'][loc_name]['netracks'][data_integrity_check.rack_field(rack.name)] = {}
 
         return(loc_dict)
 
-    def __init__(self, device, device_data_dict, site):
-        global logger, netbox_access_token, netbox_url, nb, loc_dict, site_name
-        logger = myLogger(__name__)
-        
+    def index_site_locations(loc_dict) -> dict:
+        """
+        This function adds a 'location_set' and a 'rack_set' to every site in loc_dict, so hostname_check answers with set lookups instead of walking the nested dicts.
+        """
+        for site in loc_dict.keys():
+            loc_dict[site]['location_set'] = set(loc_dict[site]['locations'].keys())
+            loc_dict[site]['rack_set'] = set()
+
+            for loc in loc_dict[site]['locations'].keys():
+                loc_dict[site]['rack_set'].update(loc_dict[site]['locations'][loc]['netracks'].keys())
+
+        return(loc_dict)
+
+    def connect_netbox():
+        """
+        This function sets up the Netbox API client shared by the whole run, if it is not set up yet, and returns it.
+        """
+        global netbox_access_token, netbox_url, nb
+
         load_dotenv()
-        site_name = site
         netbox_access_token = os.environ.get('NETBOX-ACCESS-TOKEN')
         netbox_url = 'https://NETBOX-URL-GOES-HERE'
-        nb = pynetbox.api(netbox_url, token=netbox_access_token)
 
-        loc_dict = data_integrity_check.compile_site_locations()
+        with nb_lock:
+            if nb == None:
+                nb = pynetbox.api(netbox_url, token=netbox_access_token)
+
+        return(nb)
+
+    def load_site_locations() -> dict:
+        """
+        This function returns the run's site/location/rack index, building it on first use. Every later integrity check in the run gets the same index.
+
+        If NETBOX-LOCATION-INDEX-FILE is set, the index is also kept there, and a copy younger than NETBOX-LOCATION-INDEX-TTL seconds is used instead of asking Netbox again.
+        """
+        global loc_dict
+
+        with loc_dict_lock:
+            if loc_dict != None:
+                return(loc_dict)
+
+            data_integrity_check.connect_netbox()
+
+            index_cache = persistent_cache.open(
+                os.environ.get('NETBOX-LOCATION-INDEX-FILE', ''),
+                'netbox_location_index',
+                float(os.environ.get('NETBOX-LOCATION-INDEX-TTL', 3600)), # Seconds. New racks and locations show up once the saved index is this old.
+            )
+            site_locations = index_cache.get(netbox_url) if index_cache != None else None
+
+            if site_locations == None:
+                site_locations = data_integrity_check.compile_site_locations()
+                logger.info(f"Pulled the site/location/rack index for {len(site_locations)} sites from Netbox.")
+
+                if index_cache != None:
+                    index_cache.put(netbox_url, site_locations)
+
+            else:
+                logger.info(f"Loaded the site/location/rack index for {len(site_locations)} sites from {index_cache.path}.")
+
+            loc_dict = data_integrity_check.index_site_locations(site_locations)
+
+            return(loc_dict)
+
+    def __init__(self, device, device_data_dict, site):
+        global logger, site_name
+        logger = myLogger(__name__)
+        
+        site_name = site
+        data_integrity_check.connect_netbox()
+        data_integrity_check.load_site_locations()
 
         # self.dns_check, self.dns_check_message = data_integrity_check.dns_check(device, device_data_dict['ip_addr'])
         # print(self.dns_check, self.dns_check_message) TO-DO: Create functions with the associated error messages to make fixes or create tickets accordingly. 
@@ -378,4 +475,6 @@ class data_integrity_check():
 
         self.hostname_check, self.hostname_check_message = data_integrity_check.hostname_check(device, site)
 
-        print(device, self.hostname_check, self.hostname_check_error)
+        logger.debug(f"{device} hostname_check: {self.hostname_check}, {self.hostname_check_message}")
+
+logger = lazyLogger(__name__)
@@ -1,53 +1,409 @@
+import os
 import re
+import asyncio
+import ipaddress
+import time
 import socket
-from dns import resolver
+import threading
+from collections import OrderedDict
+from dns import resolver, asyncresolver, query, zone
+
+from logger import lazyLogger
+
+ip_address_regex = re.compile(r"(\d{1,3}\.){3}\d{1,3}")
+dns_nameservers = ['8.8.8.8'] # Your internal DNS address goes here.
+
+dns_query = None # The process-wide dnspython resolver. Built on first use by dns_resolve_hostname.shared_resolver.
+dns_cache = OrderedDict() # (dns_type, request_item) -> [expires_at, answer], least recently used first.
+dns_pending = {} # (dns_type, request_item) -> threading.Event, set once the thread that is querying it has stored the answer.
+dns_stats = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'prefetch_hits': 0} # Run-wide counters for the run summary. Every miss is one query to the nameserver.
+dns_cache_lock = threading.Lock()
+
+prefetch_forward = {} # hostname -> [ip, ...], loaded by prefetch_networks. Both the FQDN and the short name are keys.
+prefetch_reverse = {} # ip -> hostname, loaded by prefetch_networks.
+prefetched_networks = [] # Networks whose PTR data is fully loaded, so an IP in them with no entry in prefetch_reverse has no PTR record.
 
 class dns_resolve_hostname():
+    """
+    This class resolves hostnames to IPs (A records) and IPs to hostnames (reverse lookups), through one process-wide cache.
+
+    Every answer is cached until its record TTL runs out, and names that do not exist are cached for DNS-NEGATIVE-TTL seconds,
+    so every unique name or IP is only sent to the nameserver once per run, no matter how many modules ask for it.
+    """
 
     def dns_determiner(request_item):
-                
-        regex = re.compile("(\d{1,3}\.){3}\d{1,3}")
+
         request_item = request_item.lower().strip()
 
-        if regex.match(request_item):
+        if ip_address_regex.match(request_item):
             return ("IP") # IP address
 
         else:
             return ("A") # A-record
 
-    def dns_reporter(request_item, dns_type):
-        dns_query = resolver.Resolver()
-        dns_query.nameservers = ['8.8.8.8'] # Your internal DNS address goes here.
-        
-        answer_list = []
+    def shared_resolver():
+        """
+        This function returns the process-wide dnspython resolver, building it the first time it is needed.
+        """
+        global dns_query
 
-        request_item = request_item.lower().strip()
-        
-        # If request_item is IP record
+        with dns_cache_lock:
+            if dns_query == None:
+                dns_query = resolver.Resolver()
+                dns_query.nameservers = dns_nameservers
+
+        return(dns_query)
+
+    def query_nameserver(request_item, dns_type) -> tuple:
+        """
+        This function sends a single, uncached query for request_item.
+
+        Returns (answer, ttl_seconds). answer is a hostname string for 'IP' queries and a list of IPs for 'A' queries, empty if the name does not exist.
+        ttl_seconds is None when the lookup failed for another reason (e.g. a timeout), so the failure is not cached.
+        """
         if dns_type == "IP":
             try:
-                answer = socket.gethostbyaddr(request_item)[0]
-                return answer
+                return(socket.gethostbyaddr(request_item)[0], float(os.environ.get('DNS-REVERSE-TTL', 300))) # gethostbyaddr does not report the PTR record's TTL.
+
+            except socket.herror: # The address has no PTR record.
+                return('', float(os.environ.get('DNS-NEGATIVE-TTL', 60)))
 
             except:
-                answer = ''
-                return answer
-        
-        # If request_item is A record
+                return('', None)
 
-        elif dns_type == "A":
-            try:
-                question = dns_query.resolve(request_item, search=True) #Auto append DNS suffixes
-                
-                for answer in question:
-                    dns_answer = answer.to_text()
-                    answer_list.append(dns_answer)
-                
-                return answer_list
+        try:
+            question = dns_resolve_hostname.shared_resolver().resolve(request_item, search=True) #Auto append DNS suffixes
+            return([answer.to_text() for answer in question], max(0, question.expiration - time.time()))
 
-            except:
-                answer_list == ''
-                return answer_list
+        except (resolver.NXDOMAIN, resolver.NoAnswer):
+            return([], float(os.environ.get('DNS-NEGATIVE-TTL', 60)))
+
+        except:
+            return([], None)
+
+    def dns_reporter(request_item, dns_type, failed_items=None):
+        """
+        This function answers a lookup from the shared cache, and only queries the nameserver on a miss or an expired entry.
+
+        When several threads ask for the same uncached name at once, only the first one queries it. The others wait for its answer.
+
+        A failed lookup (e.g. a timeout) answers empty, just like a name that does not exist. Pass a set as failed_items to have the item added to it when its lookup failed.
+        """
+        request_item = request_item.lower().strip()
+        cache_key = (dns_type, request_item)
+
+        prefetched = dns_resolve_hostname.prefetch_lookup(request_item, dns_type)
+        if prefetched != None:
+            return(prefetched)
+
+        while True:
+            with dns_cache_lock:
+                cached = dns_cache.get(cache_key)
+
+                if cached != None and cached[0] > time.monotonic():
+                    dns_cache.move_to_end(cache_key)
+                    dns_stats['hits'] += 1
+                    if len(cached[1]) == 0:
+                        dns_stats['negative_hits'] += 1
+                    return(cached[1] if dns_type == "IP" else list(cached[1])) # Callers get their own copy of the list.
+
+                pending = dns_pending.get(cache_key)
+                if pending == None:
+                    dns_pending[cache_key] = threading.Event()
+                    dns_stats['misses'] += 1
+                    break
+
+            pending.wait() # Another thread is querying this name right now. Its answer will be in the cache when it is done, unless its query failed.
+
+        try:
+            answer, ttl_seconds = dns_resolve_hostname.query_nameserver(request_item, dns_type)
+
+            dns_resolve_hostname.cache_store(cache_key, answer, ttl_seconds)
+
+            if ttl_seconds == None and failed_items != None:
+                failed_items.add(request_item)
+
+        finally:
+            with dns_cache_lock:
+                dns_pending.pop(cache_key).set()
+
+        return(answer if dns_type == "IP" else list(answer))
+
+    def cache_store(cache_key, answer, ttl_seconds):
+        """
+        This function caches an answer for ttl_seconds, dropping the least recently used entries past DNS-CACHE-SIZE. Answers with no TTL are not cached.
+        """
+        if ttl_seconds == None:
+            return
+
+        with dns_cache_lock:
+            dns_cache[cache_key] = [time.monotonic() + ttl_seconds, answer]
+            dns_cache.move_to_end(cache_key)
+
+            while len(dns_cache) > int(os.environ.get('DNS-CACHE-SIZE', 10000)):
+                dns_cache.popitem(last=False)
+
+    async def query_nameserver_async(request_item, dns_type, async_resolver) -> tuple:
+        """
+        This function is the asyncio version of query_nameserver, used by resolve_bulk. It returns answers in the same (answer, ttl_seconds) shape.
+
+        Reverse lookups are PTR queries through the resolver, instead of the blocking socket.gethostbyaddr, so they obey the same per-query timeout.
+        """
+        empty_answer = '' if dns_type == "IP" else []
+
+        try:
+            if dns_type == "IP":
+                question = await async_resolver.resolve_address(request_item)
+                return(question[0].to_text().rstrip('.'), max(0, question.expiration - time.time()))
+
+            question = await async_resolver.resolve(request_item, search=True)
+            return([answer.to_text() for answer in question], max(0, question.expiration - time.time()))
+
+        except (resolver.NXDOMAIN, resolver.NoAnswer):
+            return(empty_answer, float(os.environ.get('DNS-NEGATIVE-TTL', 60)))
+
+        except:
+            return(empty_answer, None)
+
+    async def query_many(request_items) -> dict:
+        """
+        This function queries every item concurrently, with at most DNS-BULK-IN-FLIGHT queries outstanding and DNS-QUERY-TIMEOUT seconds allowed per query.
+
+        Returns {request_item: (answer, ttl_seconds)}.
+        """
+        async_resolver = asyncresolver.Resolver()
+        async_resolver.nameservers = dns_nameservers
+        async_resolver.lifetime = float(os.environ.get('DNS-QUERY-TIMEOUT', 2))
+
+        in_flight = asyncio.Semaphore(max(1, int(os.environ.get('DNS-BULK-IN-FLIGHT', 50))))
+
+        async def query_one(request_item):
+            async with in_flight:
+                return(request_item, await dns_resolve_hostname.query_nameserver_async(request_item, dns_resolve_hostname.dns_determiner(request_item), async_resolver))
+
+        return(dict(await asyncio.gather(*[query_one(request_item) for request_item in request_items])))
+
+    def resolve_bulk(request_items, failed_items=None) -> dict:
+        """
+        This function resolves a whole batch of hostnames and IPs at once, e.g. every device of a discovery wave or every AP of a site, and warms the shared cache with the answers.
+
+        Items that are already cached are answered from the cache. The rest are queried concurrently (see query_many) instead of one at a time,
+        so one slow or timing-out name no longer holds up the others.
+
+        Returns {request_item: answer}, keyed by the lower-cased, stripped item. Answers have the same shape as dns_reporter's.
+
+        A failed lookup (e.g. a timeout) answers empty, just like a name that does not exist. Pass a set as failed_items to have the failed items added to it, so the two can be told apart.
+        """
+        request_items = list(dict.fromkeys(request_item.lower().strip() for request_item in request_items))
+
+        answers = {}
+        query_items = [] # Items this call claims and queries.
+        waiting_items = [] # Items another thread is already querying.
+
+        for request_item in request_items:
+            prefetched = dns_resolve_hostname.prefetch_lookup(request_item, dns_resolve_hostname.dns_determiner(request_item))
+            if prefetched != None:
+                answers[request_item] = prefetched
+
+        with dns_cache_lock:
+            for request_item in request_items:
+                if request_item in answers:
+                    continue
+
+                cache_key = (dns_resolve_hostname.dns_determiner(request_item), request_item)
+                cached = dns_cache.get(cache_key)
+
+                if cached != None and cached[0] > time.monotonic():
+                    dns_cache.move_to_end(cache_key)
+                    dns_stats['hits'] += 1
+                    if len(cached[1]) == 0:
+                        dns_stats['negative_hits'] += 1
+                    answers[request_item] = cached[1] if cache_key[0] == "IP" else list(cached[1])
+
+                elif cache_key in dns_pending:
+                    waiting_items.append(request_item)
+
+                else:
+                    dns_pending[cache_key] = threading.Event()
+                    dns_stats['misses'] += 1
+                    query_items.append(request_item)
+
+        try:
+            if len(query_items) >= 1:
+                for request_item, (answer, ttl_seconds) in asyncio.run(dns_resolve_hostname.query_many(query_items)).items():
+                    dns_resolve_hostname.cache_store((dns_resolve_hostname.dns_determiner(request_item), request_item), answer, ttl_seconds)
+                    answers[request_item] = answer if dns_resolve_hostname.dns_determiner(request_item) == "IP" else list(answer)
+
+                    if ttl_seconds == None and failed_items != None:
+                        failed_items.add(request_item)
+
+        finally:
+            with dns_cache_lock:
+                for request_item in query_items:
+                    dns_pending.pop((dns_resolve_hostname.dns_determiner(request_item), request_item)).set()
+
+        for request_item in waiting_items:
+            answers[request_item] = dns_resolve_hostname.dns_reporter(request_item, dns_resolve_hostname.dns_determiner(request_item))
+
+            if failed_items != None: # Only answers that came back from the nameserver are cached, so an item missing from the cache failed.
+                with dns_cache_lock:
+                    if (dns_resolve_hostname.dns_determiner(request_item), request_item) not in dns_cache:
+                        failed_items.add(request_item)
+
+        logger.debug(f"Bulk-resolved {len(request_items)} names and IPs: {len(query_items)} queried, {len(request_items) - len(query_items) - len(waiting_items)} cached, {len(waiting_items)} already in flight.")
+
+        return(answers)
+
+    def prefetch_lookup(request_item, dns_type):
+        """
+        This function answers a lookup from the prefetched site index, without any query.
+
+        Returns None when the index cannot answer: a hostname it never saw, or an IP outside every prefetched network.
+        """
+        with dns_cache_lock:
+            if dns_type == "IP":
+                if request_item in prefetch_reverse:
+                    dns_stats['prefetch_hits'] += 1
+                    return(prefetch_reverse[request_item])
+
+                if len(prefetched_networks) >= 1:
+                    try:
+                        ip_addr = ipaddress.ip_address(request_item)
+                    except ValueError:
+                        return(None)
+
+                    if any(ip_addr in network for network in prefetched_networks): # The whole network was loaded, so this IP really has no PTR record.
+                        dns_stats['prefetch_hits'] += 1
+                        return('')
+
+                return(None)
+
+            if request_item in prefetch_forward:
+                dns_stats['prefetch_hits'] += 1
+                return(list(prefetch_forward[request_item]))
+
+            return(None)
+
+    def reverse_zones(network) -> list:
+        """
+        This function lists the /24 reverse zones that cover an IPv4 network, e.g. 10.1.2.0/23 -> ['2.1.10.in-addr.arpa', '3.1.10.in-addr.arpa'].
+        """
+        if network.prefixlen >= 24:
+            zone_networks = [network.supernet(new_prefix=24)]
+        else:
+            zone_networks = list(network.subnets(new_prefix=24))
+
+        return([".".join(reversed(str(zone_network.network_address).split(".")[:3])) + ".in-addr.arpa" for zone_network in zone_networks])
+
+    def zone_transfer(zone_name) -> dict:
+        """
+        This function pulls a reverse zone with AXFR from DNS-AXFR-SERVER (the first nameserver by default).
+
+        Returns {ip: hostname}, or None if the server refused the transfer or could not be reached.
+        """
+        try:
+            transferred_zone = zone.from_xfr(query.xfr(os.environ.get('DNS-AXFR-SERVER', dns_nameservers[0]), zone_name, lifetime=float(os.environ.get('DNS-QUERY-TIMEOUT', 2)) * 10))
+        except Exception as e:
+            logger.debug(f"Zone transfer of {zone_name} failed, falling back to a PTR sweep. Reason: {e}")
+            return(None)
+
+        zone_octets = zone_name.split(".")[:3]
+        ptr_records = {}
+
+        for name, ttl, ptr_record in transferred_zone.iterate_rdatas('PTR'):
+            ip_addr = ".".join(list(reversed(zone_octets)) + [name.to_text()])
+            ptr_records[ip_addr] = ptr_record.target.to_text().rstrip('.')
+
+        return(ptr_records)
+
+    def prefetch_networks(prefixes) -> dict:
+        """
+        This function bulk-loads the PTR and A data for a site's management subnets into the prefetch index, so every later
+        hostname <-> IP check inside those subnets is answered locally (see prefetch_lookup).
+
+        PTR data comes from a zone transfer of each covering /24 reverse zone when DNS-PREFETCH-MODE is 'axfr' and the server allows it,
+        and from a sweep of PTR queries over every host in the prefix otherwise. The names found are then resolved forward with resolve_bulk.
+
+        Lookups that failed (e.g. timed out) are never answered from the index. A prefix with a failed PTR query is not marked as fully loaded,
+        and a name whose forward lookup failed is left out, so those lookups still go to the nameserver later.
+
+        Returns a report of the prefetch: prefixes loaded, how each was loaded, seconds taken, and the index size.
+        """
+        prefetch_start = time.perf_counter()
+        report = {'prefixes': 0, 'axfr_zones': 0, 'swept_hosts': 0, 'skipped_prefixes': 0, 'failed_lookups': 0}
+        max_hosts = int(os.environ.get('DNS-PREFETCH-MAX-HOSTS', 4096))
+
+        ptr_records = {}
+        loaded_networks = []
+
+        for prefix in prefixes:
+            network = ipaddress.ip_network(prefix, strict=False)
+
+            if network.version != 4 or network.num_addresses > max_hosts:
+                logger.warning(f"Not prefetching DNS for {network}: only IPv4 prefixes of up to {max_hosts} addresses are prefetched.")
+                report['skipped_prefixes'] += 1
+                continue
+
+            sweep_hosts = []
+
+            for zone_name in dns_resolve_hostname.reverse_zones(network):
+                zone_records = None
+                if os.environ.get('DNS-PREFETCH-MODE', 'off') == 'axfr':
+                    zone_records = dns_resolve_hostname.zone_transfer(zone_name)
+
+                if zone_records != None:
+                    report['axfr_zones'] += 1
+                    ptr_records.update({ip_addr: hostname for ip_addr, hostname in zone_records.items() if ipaddress.ip_address(ip_addr) in network})
+                else:
+                    zone_network = ipaddress.ip_network(".".join(reversed(zone_name.split(".")[:3])) + ".0/24")
+                    sweep_hosts += [str(ip_addr) for ip_addr in network.hosts() if ip_addr in zone_network]
+
+            failed_hosts = set()
+
+            if len(sweep_hosts) >= 1:
+                report['swept_hosts'] += len(sweep_hosts)
+                ptr_records.update({ip_addr: hostname for ip_addr, hostname in dns_resolve_hostname.resolve_bulk(sweep_hosts, failed_hosts).items() if hostname != ''})
+
+            report['prefixes'] += 1
+
+            if len(failed_hosts) >= 1: # The PTR answers that did come back are still used, but a missing entry here does not mean "no PTR record".
+                report['failed_lookups'] += len(failed_hosts)
+                logger.warning(f"{len(failed_hosts)} PTR queries failed while prefetching {network}. IPs in it with no prefetched PTR record will still be queried.")
+            else:
+                loaded_networks.append(network)
+
+        failed_names = set()
+        forward_answers = dns_resolve_hostname.resolve_bulk(set(ptr_records.values()), failed_names) # The PTR names may live in any forward zone, so they are resolved rather than transferred.
+        report['failed_lookups'] += len(failed_names)
+
+        with dns_cache_lock:
+            prefetch_reverse.update(ptr_records)
+            for hostname, ip_list in forward_answers.items():
+                if hostname in failed_names: # Left out, so the name is queried again instead of reading as NXDOMAIN.
+                    continue
+
+                prefetch_forward[hostname] = ip_list
+                prefetch_forward.setdefault(hostname.split('.')[0], ip_list) # dns_check looks devices up by their short name.
+            prefetched_networks.extend(loaded_networks)
+
+            report['reverse_entries'] = len(prefetch_reverse)
+            report['forward_entries'] = len(prefetch_forward)
+
+        report['seconds'] = round(time.perf_counter() - prefetch_start, 3)
+
+        return(report)
+
+    def clear_cache():
+        """
+        This function empties the shared cache and the prefetch index, and zeroes the counters.
+        """
+        with dns_cache_lock:
+            dns_cache.clear()
+            prefetch_forward.clear()
+            prefetch_reverse.clear()
+            prefetched_networks.clear()
+            for counter in dns_stats:
+                dns_stats[counter] = 0
 
     def __init__(self, hostname):
         
@@ -72,3 +428,5 @@ class dns_resolve_hostname():
             elif dns_type == 'IP':
                 self.ip_addr = hostname
                 self.dns_hostname = dns_answer               
+
+logger = lazyLogger(__name__)
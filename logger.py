@@ -1,19 +1,34 @@
+import threading
 import logging, logging.handlers
 
 loggers = {}
+loggers_lock = threading.Lock() # Scans can run on worker threads, so only one thread may build a given logger's handler.
 
 def myLogger(name):
     global loggers
-    
-    if loggers.get(name):
-        return loggers.get(name)
-    else:
-        logger = logging.getLogger(name)
-        logger.setLevel(logging.DEBUG)
-        handler = logging.handlers.SysLogHandler(address=('SYSLOG-SERVER-IP-GOES-HERE',514))
-        formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        loggers[name] = logger
-                       
-        return logger
+
+    with loggers_lock:
+        if loggers.get(name):
+            return loggers.get(name)
+        else:
+            logger = logging.getLogger(name)
+            logger.setLevel(logging.DEBUG)
+            handler = logging.handlers.SysLogHandler(address=('SYSLOG-SERVER-IP-GOES-HERE',514))
+            formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
+            loggers[name] = logger
+
+            return logger
+
+class lazyLogger():
+    """
+    A stand-in for myLogger(name) that a module can assign at import time. The real logger, and its syslog handler, is only built the first time something is logged,
+    so importing the module never needs the syslog server to be reachable.
+    """
+
+    def __getattr__(self, attribute):
+        return(getattr(myLogger(self.name), attribute))
+
+    def __init__(self, name):
+        self.name = name
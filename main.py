@@ -7,6 +7,7 @@ from logger import myLogger
 
 from cdpMasterDictHandler import cdpMasterDictHandler
 from netbox_data_handler import netbox_data_handler
+from cdp_records import serialize_site_data
 from dotenv import load_dotenv
 
 def nb_retrieve_all_sites(netbox_access_token) -> list:
@@ -110,7 +111,7 @@ site_data = nb_retrieve_all_sites(netbox_access_token) # Netbox script to grab a
 all_site_CDP_data = cdpMasterDictHandler(site_data) # Pass the site_data to the cdpDiscoveryFunctions module.
 
 with open('.\output\cdp-dump.yml', 'w+') as outfile:
-    yaml.dump(all_site_CDP_data.site_data_dict, outfile)
+    yaml.dump(serialize_site_data(all_site_CDP_data.site_data_dict), outfile) # Turns the compact device records back into the plain dicts the dump has always used.
     print("Stored device scan-data in .\output\cdp-dump.yml")
 
 netbox_data_handler(all_site_CDP_data.site_data_dict)
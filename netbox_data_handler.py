@@ -1,59 +1,238 @@
 import os
 import re
+import time
 import yaml
 import pynetbox
-from logger import myLogger
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logger import myLogger, lazyLogger
 from pprint import pprint
 from dotenv import load_dotenv
 from netmiko import ConnectHandler
 from data_integrity_check import data_integrity_check
 
+device_index = None # {'serial': {}, 'asset_tag': {}, 'name': {}}, each mapping a value to its Netbox device. Loaded once per run by load_device_index.
+device_pending = {} # (field, value) -> threading.Event, set once the nbCreateHost call that is creating a device with that serial or asset tag is done.
+device_index_lock = threading.Lock()
+
 class netbox_data_handler():
 
+    def index_device(device):
+        """
+        This function files a Netbox device under its serial, asset tag and name in device_index. Empty values are never filed, so an asset tag of None can not match anything.
+
+        The caller must hold device_index_lock.
+        """
+        for field in device_index.keys():
+            field_value = getattr(device, field, None)
+
+            if field_value != None and field_value != '':
+                device_index[field][field_value] = device
+
+    def load_device_index() -> dict:
+        """
+        This function returns the run's Netbox device index, pulling every device from Netbox once (one paginated fetch) on first use.
+        """
+        global device_index
+
+        with device_index_lock:
+            if device_index == None:
+                device_index = {'serial': {}, 'asset_tag': {}, 'name': {}}
+                load_start = time.perf_counter()
+
+                for device in data_integrity_check.connect_netbox().dcim.devices.all():
+                    netbox_data_handler.index_device(device)
+
+                logger.info(f"Indexed {len(device_index['name'])} Netbox devices by name, {len(device_index['serial'])} by serial and {len(device_index['asset_tag'])} by asset tag in {time.perf_counter() - load_start:.2f} seconds.")
+
+            return(device_index)
+
+    def prefetch_site_dns(site, site_id):
+        """
+        This function loads the DNS data for a site's management prefixes into the prefetch index, so the site's DNS checks are answered locally.
+
+        The prefixes are the site's Netbox prefixes with the DNS-PREFETCH-PREFIX-ROLE role. Returns the prefetch report from dns_resolve_hostname.prefetch_networks.
+        """
+        from dns_resolve_hostname import dns_resolve_hostname
+
+        prefixes = [str(prefix.prefix) for prefix in data_integrity_check.connect_netbox().ipam.prefixes.filter(site_id=site_id, role=os.environ.get('DNS-PREFETCH-PREFIX-ROLE', 'management'))]
+        prefetch_report = dns_resolve_hostname.prefetch_networks(prefixes)
+
+        print(f"Prefetched DNS for site {site}: {prefetch_report['prefixes']} prefixes in {prefetch_report['seconds']} seconds, index now holds {prefetch_report['forward_entries']} names and {prefetch_report['reverse_entries']} IPs.")
+        logger.info(f"Prefetched DNS for site {site}: {prefetch_report}")
+
+        return(prefetch_report)
+
+    def dns_check_device(device, ip_addr) -> tuple:
+        """
+        This function runs the DNS check for one device on an integrity worker, and turns a crash into a failed check instead of losing the whole run.
+
+        Returns [RESULT, error_message, verdict_source], where verdict_source says whether the verdict came from the verdict cache ('cached') or from DNS ('fresh').
+        """
+        try:
+            return(data_integrity_check.dns_check_verdict(device, ip_addr))
+
+        except Exception as e:
+            logger.error(f"dns_check crashed for {device} ({ip_addr}). Reason: {e}")
+            return(False, f"dns_check_error: {e}", 'fresh')
+
+    def check_site_integrity(site, device_scan_data, executor) -> dict:
+        """
+        This function runs the integrity checks for one site, cheapest first, and returns the site's rows of the integrity report.
+
+        1. Every hostname of the site is checked against the naming standard in one batch (data_integrity_check.validate_hostnames). This is local and fast.
+        2. Devices with no usable IP fail right away. A list means DNS already returned several answers for the name.
+        3. Only the devices that passed both are handed to the worker pool for the DNS check, which is the slow part.
+
+        A device that fails an earlier step is never sent to a later one. The DNS checks are left running on the pool; the report rows hold their Futures until __init__ collects them.
+        """
+        site_report = {}
+        hostname_results = data_integrity_check.validate_hostnames(list(device_scan_data.keys()), site)
+
+        for device in device_scan_data.keys():
+            ip_addr = device_scan_data[device].get('ip_addr', '')
+            site_report[device] = {
+                'ip_addr': ip_addr,
+                'hostname_check': hostname_results[device]['result'],
+                'hostname_check_message': hostname_results[device]['error_message'],
+                'dns_check': None,
+                'dns_check_message': 'skipped: hostname_check failed',
+                'dns_check_source': None,
+            }
+
+            if hostname_results[device]['result'] == False:
+                continue
+
+            if not isinstance(ip_addr, str) or ip_addr == '':
+                site_report[device]['dns_check'] = False
+                site_report[device]['dns_check_message'] = 'ip_not_provided'
+                continue
+
+            site_report[device]['dns_check'] = executor.submit(netbox_data_handler.dns_check_device, device, ip_addr)
+            site_report[device]['dns_check_message'] = 'pending'
+
+        return(site_report)
+
     def __init__(self, site_data_dict):
+        global logger
+
         logger = myLogger(__name__)
-        for site in site_data_dict.keys():
-            
-            seed_device = site_data_dict[site]['cdp_seed_device']
-            device_scan_data = site_data_dict[site]['device_scan_data']
-            site_id = site_data_dict[site]['site_id']
+        integrity_workers = max(1, int(os.environ.get('INTEGRITY-CHECK-WORKERS', 8))) # How many DNS checks run at once, across every site.
+        integrity_report = {} # site -> device -> the results of every check. Collected here, then logged and saved once.
+        integrity_start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=integrity_workers) as executor:
+            for site in site_data_dict.keys():
+                
+                seed_device = site_data_dict[site]['cdp_seed_device']
+                device_scan_data = site_data_dict[site]['device_scan_data']
+                site_id = site_data_dict[site]['site_id']
+
+                if os.environ.get('DNS-PREFETCH-MODE', 'off') in ['axfr', 'sweep']:
+                    netbox_data_handler.prefetch_site_dns(site, site_id)
+
+                integrity_report[site] = netbox_data_handler.check_site_integrity(site, device_scan_data, executor) # The next site's hostname checks run while this site's DNS checks are on the pool.
+
+            for site in integrity_report.keys():
+                for device in integrity_report[site].keys():
+                    if integrity_report[site][device]['dns_check_message'] == 'pending':
+                        integrity_report[site][device]['dns_check'], integrity_report[site][device]['dns_check_message'], integrity_report[site][device]['dns_check_source'] = integrity_report[site][device]['dns_check'].result()
+
+        device_count = sum(len(integrity_report[site]) for site in integrity_report.keys())
+        hostname_failed = [device for site in integrity_report.keys() for device in integrity_report[site].keys() if integrity_report[site][device]['hostname_check'] == False]
+        dns_cached = [device for site in integrity_report.keys() for device in integrity_report[site].keys() if integrity_report[site][device]['dns_check_source'] == 'cached']
+        dns_fresh = [device for site in integrity_report.keys() for device in integrity_report[site].keys() if integrity_report[site][device]['dns_check_source'] == 'fresh']
+        dns_failed = [device for site in integrity_report.keys() for device in integrity_report[site].keys() if integrity_report[site][device]['dns_check'] == False]
+
+        print(f"Integrity checks finished for {device_count} devices across {len(integrity_report)} sites in {time.perf_counter() - integrity_start:.2f} seconds: {len(hostname_failed)} failed hostname_check, {len(dns_failed)} failed dns_check. {len(dns_cached)} DNS verdicts were cached, {len(dns_fresh)} fresh.")
+        logger.info(f"Integrity checks finished for {device_count} devices across {len(integrity_report)} sites in {time.perf_counter() - integrity_start:.2f} seconds with {integrity_workers} workers: {len(hostname_failed)} failed hostname_check, {len(dns_failed)} failed dns_check. {len(dns_cached)} DNS verdicts were cached, {len(dns_fresh)} fresh.")
+
+        if len(hostname_failed) >= 1 or len(dns_failed) >= 1:
+            logger.error(f"""
+            The following devices failed hostname_check:
+
+            {hostname_failed}
+
+            The following devices failed dns_check:
+
+            {dns_failed}
+            """)
+
+        integrity_report_file = os.environ.get('INTEGRITY-REPORT-FILE', './output/integrity-report.yml')
+        if integrity_report_file != '':
+            if os.path.dirname(integrity_report_file) != '':
+                os.makedirs(os.path.dirname(integrity_report_file), exist_ok=True)
 
-            for device in device_scan_data.keys():
-                integrity_check_result = data_integrity_check(device, device_scan_data[device], site)
+            with open(integrity_report_file, 'w+') as outfile:
+                yaml.dump(integrity_report, outfile)
+                print(f"Stored the integrity report in {integrity_report_file}")
+
+        self.integrity_report = integrity_report
 
     def nbCreateHost(refined_host):
+        """
+        This function creates a discovered host in Netbox, unless a Netbox device already matches its serial or asset tag.
 
-        netbox_url = 'https://NETBOX-URL-GOES-HERE'
-        nb = pynetbox.api(netbox_url, token=netbox_access_token)
+        Matches are looked up in the run's device index instead of downloading and scanning every Netbox device per host.
+        A created device is added to the index right away, so a later host with the same serial matches it.
 
-        devices = nb.dcim.devices.all()
+        The serial and asset tag are reserved in device_pending while the device is being created, so two workers creating the same host at once
+        can not both create it. The second one waits for the first, then finds the new device in the index.
+        """
+        device_index = netbox_data_handler.load_device_index()
+        pending_keys = [(field, getattr(refined_host, field)) for field in ['serial', 'asset_tag'] if getattr(refined_host, field) not in [None, '']]
 
         found = False
-        
-        for device in devices: 
-            if refined_host.serial == device.serial: # If a matching serial is found in Netbox, update the device.
-                found = True
-                print(f"A serial has been found that matches {refined_host.serial} in Netbox. An update API call must be made.")
-            
-            if refined_host.asset_tag == device.asset_tag: # BE CAREFUL HERE!! Asset-tag 'None' can cause false-positives. 
-                found = True
-                print(f"An asset tag has been found that matches {refined_host.asset_tag} in Netbox. An update API call must be made.")
-        
+
+        while True:
+            with device_index_lock:
+                if refined_host.serial in device_index['serial']: # If a matching serial is found in Netbox, update the device.
+                    found = True
+                    print(f"A serial has been found that matches {refined_host.serial} in Netbox. An update API call must be made.")
+                
+                elif refined_host.asset_tag in device_index['asset_tag']: # None asset tags are never indexed, so they can not cause false-positives here.
+                    found = True
+                    print(f"An asset tag has been found that matches {refined_host.asset_tag} in Netbox. An update API call must be made.")
+
+                pending = [device_pending[pending_key] for pending_key in pending_keys if pending_key in device_pending]
+
+                if found or len(pending) == 0:
+                    if not found:
+                        pending_event = threading.Event()
+                        for pending_key in pending_keys:
+                            device_pending[pending_key] = pending_event
+                    break
+
+            pending[0].wait() # Another worker is creating a device with this serial or asset tag. Check the index again once it is done.
+
         if not found: # If no matching serial is found in Netbox, create a new device.
-                    
-            nb.dcim.devices.create(
+            try:
+                created_device = data_integrity_check.connect_netbox().dcim.devices.create(
                 
-                asset_tag = refined_host.asset_tag,
-                device_role = refined_host.device_role,
-                device_type = refined_host.device_type,
-                ip_addr = refined_host.ip_addr,
-                tags = refined_host.tags,
-                # location = refined_host.location,
-                manufacturer = refined_host.manufacturer,
-                name = refined_host.name,
-                # rack = refined_host.rack,
-                serial = refined_host.serial,
-                site = refined_host.site,
-                status = refined_host.status,
-
-                )
+                    asset_tag = refined_host.asset_tag,
+                    device_role = refined_host.device_role,
+                    device_type = refined_host.device_type,
+                    ip_addr = refined_host.ip_addr,
+                    tags = refined_host.tags,
+                    # location = refined_host.location,
+                    manufacturer = refined_host.manufacturer,
+                    name = refined_host.name,
+                    # rack = refined_host.rack,
+                    serial = refined_host.serial,
+                    site = refined_host.site,
+                    status = refined_host.status,
+
+                    )
+
+                with device_index_lock:
+                    netbox_data_handler.index_device(created_device)
+
+            finally:
+                with device_index_lock:
+                    for pending_key in pending_keys:
+                        device_pending.pop(pending_key, None)
+                pending_event.set()
+
+        return(found)
+
+logger = lazyLogger(__name__)
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from logger import lazyLogger
+
+open_caches = {} # (path, table) -> persistent_cache. Every caller in the process shares one connection per table.
+open_caches_lock = threading.Lock()
+
+class persistent_cache():
+    """
+    A small on-disk key -> value store with per-entry expiry, kept in a local SQLite file so it survives between runs.
+
+    Keys are tuples of strings, values are anything json can store. Entries older than ttl_seconds read as misses and are overwritten on the next put.
+    One instance can be shared by every thread in the run.
+    """
+
+    def get_many(self, keys) -> dict:
+        """
+        This function returns {key: value} for every key that has an entry younger than the TTL. Missing and expired keys are left out.
+        """
+        oldest_fresh = time.time() - self.ttl_seconds
+        found = {}
+
+        with self.lock:
+            for key in keys:
+                row = self.connection.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (persistent_cache.encode_key(key),)).fetchone()
+
+                if row != None and row[1] >= oldest_fresh:
+                    found[key] = json.loads(row[0])
+
+        return(found)
+
+    def get(self, key, default=None):
+        return(self.get_many([key]).get(key, default))
+
+    def put_many(self, entries):
+        """
+        This function stores every {key: value} pair in entries, stamped with the current time, in a single transaction.
+        """
+        stored_at = time.time()
+
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                    [(persistent_cache.encode_key(key), json.dumps(value), stored_at) for key, value in entries.items()],
+                )
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def delete(self, key):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (persistent_cache.encode_key(key),))
+
+    def purge_expired(self) -> int:
+        """
+        This function deletes every expired entry, so the file does not grow forever. Returns how many entries were removed.
+        """
+        with self.lock:
+            with self.connection:
+                deleted = self.connection.execute(f"DELETE FROM {self.table} WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+
+        return(deleted.rowcount)
+
+    def encode_key(key) -> str:
+        return(json.dumps(list(key)) if isinstance(key, tuple) else json.dumps([key]))
+
+    def open(path, table, ttl_seconds):
+        """
+        This function returns the shared cache for a SQLite file and table, creating both if needed.
+
+        Returns None if path is empty, so callers can turn a cache off from the .env file.
+        """
+        if path == '' or path == None:
+            return(None)
+
+        with open_caches_lock:
+            if (path, table) not in open_caches:
+                open_caches[(path, table)] = persistent_cache(path, table, ttl_seconds)
+
+            open_caches[(path, table)].ttl_seconds = ttl_seconds
+
+            return(open_caches[(path, table)])
+
+    def __init__(self, path, table, ttl_seconds):
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.table = table # Only ever set from code, never from device output, so it is safe to format into the SQL.
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30) # Guarded by self.lock, so it can be used from any thread.
+        with self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+
+        logger.debug(f"Opened persistent cache {path}:{table} with a TTL of {ttl_seconds} seconds.")
+
+logger = lazyLogger(__name__)
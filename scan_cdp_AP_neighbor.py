@@ -1,85 +1,331 @@
+import os
+import re
+import threading
+import contextlib
 import logging, logging.handlers
+from concurrent.futures import ThreadPoolExecutor
 
-from logger import myLogger
-from netmiko import ConnectHandler
+from logger import lazyLogger
+from ssh_transport import ssh_transport
+from persistent_cache import persistent_cache
 from pprint import pprint
 from dns_resolve_hostname import dns_resolve_hostname
 
+wireless_controllers = [ # Every controller AP discovery searches. In 'sequential' mode they are asked in this order, and in 'fanout' mode an AP found on several controllers keeps the serial from the earliest one in the list.
+    {'host': 'WLC-HOSTNAME-GOES-HERE', 'platform': 'aireos'},
+    {'host': 'WLC2-HOSTNAME-GOES-HERE', 'platform': 'catalyst'},
+]
+
+wlc_inventory_commands = { # platform -> the per-AP command, and the command that returns every AP at once (AP-INVENTORY-MODE 'bulk').
+    'aireos': {
+        'per-ap': 'show ap inventory {ap}',
+        'bulk': 'show ap inventory all',
+    },
+    'catalyst': { # 9800s have no 'show ap inventory all', but their general AP config carries the serial.
+        'per-ap': 'show ap name {ap} inventory',
+        'bulk': 'show ap config general | include Cisco AP Name|AP Serial Number',
+    },
+}
+
+wlc_inventory_regex = re.compile(r"^(?:Inventory for|Cisco AP Name\s*:)\s*(?P<ap_name>\S+)|(?:SN:|AP Serial Number\s*:)\s*(?P<serial_num>[^\s,]+)", re.MULTILINE) # AP name lines start a new AP; the next serial line belongs to it.
+
+inventory_indexes = {} # controller -> {ap_name: serial_num}. Each controller's full inventory is pulled at most once per run and shared by every site.
+inventory_lock = threading.Lock()
+inventory_pull_locks = {} # controller -> lock held while that controller's inventory is being pulled.
+
+idle_controller_sessions = {} # controller -> sessions that are open and not in use. Shared by every site's AP batch for the whole run.
+controller_session_limiters = {} # controller -> semaphore capping how many sessions are open to it at once (WLC-MAX-SESSIONS).
+controller_sessions_lock = threading.Lock()
+
+ap_discovery_stats = {'controller_queries': 0, 'routed_aps': 0, 'affinity_hits': 0, 'affinity_misses': 0} # Run-wide counters for the run summary.
+affinity_lock = threading.Lock() # Held while the learned AP -> controller affinity is read and updated, so concurrent sites do not lose each other's counts.
 
 class scan_cdp_AP_neighbor():
     """
     This class is intended to discover data about CDP-discovered APs.
     """
     
-    def wlc_5k_ssh(ap_list, username, password) -> str:
+    def wlc_ssh(controller, ap_list, username, password) -> dict:
         """
-        This function SSHs into the 5k WLC and retrieves serial_number info for the provide ap_name.
+        This function SSHs into one wireless controller and looks up the serial_number of every AP in ap_list.
 
-        Returns as a string.
+        Returns a dict of {ap_name: serial_num} for the APs the controller knows. APs it does not know are left out.
         """
-        controller = 'WLC-HOSTNAME-GOES-HERE'
-        logger.debug(f"Beginning SSH scan on {controller}.")      
+        commands = wlc_inventory_commands[controller['platform']]
+
+        if os.environ.get('AP-INVENTORY-MODE', 'per-ap') == 'bulk':
+            inventory_index = scan_cdp_AP_neighbor.wlc_inventory_index(controller['host'], commands['bulk'], username, password)
+            return({ap: inventory_index[ap] for ap in ap_list if ap in inventory_index})
 
-        connection_details = { 
-            "device_type": "cisco_wlc_ssh",
-            "host": controller,
-            "username": username,
-            "password": password,
-            }
+        logger.debug(f"Beginning SSH scan on {controller['host']}.")      
+
+        found_serials = {}
         
-        with ConnectHandler(**connection_details) as net_connect:
+        with scan_cdp_AP_neighbor.controller_session(controller['host'], username, password) as net_connect:
             for ap in ap_list:
-                command = f'show ap inventory {ap}'
-                output = net_connect.send_command(command)
-                found = False
+                output = net_connect.send_command(commands['per-ap'].format(ap=ap))
+                with affinity_lock:
+                    ap_discovery_stats['controller_queries'] += 1
                 
                 for line in output.splitlines():
                 
                     if 'SN: ' in line: 
-                        found = True
                         ap_serialnum = line.split('SN: ')[1]
-                        logger.debug(f"Found serial_num {ap_serialnum} for {ap} on {controller}")
-                        output_list.append([ap, ap_serialnum])                    
-                    else:
-                        continue 
-                
-                if not found:
-                    wlc9k_search_list.append(ap)
-            
-    def wlc_9k_ssh(wlc9k_search_list, username, password) -> str:
+                        logger.debug(f"Found serial_num {ap_serialnum} for {ap} on {controller['host']}")
+                        found_serials[ap] = ap_serialnum
+
+        return(found_serials)
+
+    @contextlib.contextmanager
+    def controller_session(controller, username, password):
         """
-        This function SSHs into the 9k WLC and retrieves serial_number info for the provide ap_name.
+        This function lends out an SSH session to a wireless controller from the run-wide session pool, opening a new one only when none is idle.
 
-        Returns as a string.
+        At most WLC-MAX-SESSIONS sessions are open to each controller at once, however many sites are discovering APs.
+        A session that raised an error is closed instead of going back to the pool, and an idle session the controller has since dropped is replaced with a new one.
         """
-        controller = 'WLC2-HOSTNAME-GOES-HERE'
-        logger.debug(f"Beginning SSH scan on {controller}.")      
+        with controller_sessions_lock:
+            if controller not in controller_session_limiters:
+                controller_session_limiters[controller] = threading.BoundedSemaphore(max(1, int(os.environ.get('WLC-MAX-SESSIONS', 2))))
+                idle_controller_sessions[controller] = []
+            session_limiter = controller_session_limiters[controller]
 
-        connection_details = { 
-            "device_type": "cisco_wlc_ssh",
-            "host": controller,
-            "username": username,
-            "password": password,
-            }
+        with session_limiter:
+            with controller_sessions_lock:
+                net_connect = idle_controller_sessions[controller].pop() if len(idle_controller_sessions[controller]) >= 1 else None
 
-        with ConnectHandler(**connection_details) as net_connect:
-            for ap in wlc9k_search_list:
-                command = f'show ap name {ap} inventory'
-                output = net_connect.send_command(command)
-                found = False
-                
-                for line in output.splitlines():
-                
-                    if 'SN: ' in line: 
-                        found = True
-                        ap_serialnum = line.split('SN: ')[1]
-                        logger.debug(f"Found serial_num {ap_serialnum} for {ap} on {controller}")
-                        output_list.append([ap, ap_serialnum])                    
-                    else:
-                        continue 
-                
-                if not found:
-                    unfound_AP_list.append(ap)
+            if net_connect != None and not scan_cdp_AP_neighbor.session_alive(net_connect):
+                logger.debug(f"A pooled session to {controller} was closed by the controller. Replacing it.")
+                net_connect = None
+
+            if net_connect == None:
+                logger.debug(f"Opening a new session to {controller}.")
+                net_connect = ssh_transport.connect(device_type="cisco_wlc_ssh", host=controller, username=username, password=password)
+
+            try:
+                yield net_connect
+            except Exception:
+                net_connect.disconnect()
+                raise
+
+            with controller_sessions_lock:
+                idle_controller_sessions[controller].append(net_connect)
+
+    def session_alive(net_connect) -> bool:
+        """
+        This function checks whether a pooled session is still open, e.g. it was not idled out by the controller. A session that is not is closed on our side too.
+        """
+        try:
+            if net_connect.is_alive():
+                return(True)
+        except Exception:
+            pass
+
+        try:
+            net_connect.disconnect()
+        except Exception:
+            pass
+
+        return(False)
+
+    def close_controller_sessions():
+        """
+        This function logs out of every pooled wireless controller session. cdpMasterDictHandler calls it once every site's AP discovery is done.
+        """
+        with controller_sessions_lock:
+            for controller, sessions in idle_controller_sessions.items():
+                for net_connect in sessions:
+                    net_connect.disconnect()
+                logger.debug(f"Closed {len(sessions)} pooled sessions to {controller}.")
+                sessions.clear()
+
+    def parse_wlc_inventory(inventory_output) -> dict:
+        """
+        This function parses a controller's full AP inventory into a name -> serial index.
+
+        It understands AireOS 'show ap inventory all' blocks ('Inventory for <AP>' ... 'SN: <serial>')
+        and Catalyst 9800 'show ap config general' lines ('Cisco AP Name : <AP>' ... 'AP Serial Number : <serial>').
+        """
+        inventory_index = {}
+        ap_name = None
+
+        for inventory_match in wlc_inventory_regex.finditer(inventory_output):
+            if inventory_match.group('ap_name') != None:
+                ap_name = inventory_match.group('ap_name')
+
+            elif ap_name != None: # Only the first serial after each AP name is the AP's own. Anything after that belongs to modules in the chassis.
+                inventory_index[ap_name] = inventory_match.group('serial_num')
+                ap_name = None
+
+        return(inventory_index)
+
+    def wlc_inventory_index(controller, inventory_command, username, password) -> dict:
+        """
+        This function pulls a controller's whole AP inventory with one command, instead of one command per AP.
+
+        The parsed index is kept in inventory_indexes, so every later site in the same run resolves its APs without touching the controller again.
+        """
+        with inventory_lock:
+            pull_lock = inventory_pull_locks.setdefault(controller, threading.Lock())
+
+        with pull_lock: # Sites that need the same controller wait for one pull instead of each pulling it. Different controllers are pulled at the same time.
+            if controller in inventory_indexes:
+                return(inventory_indexes[controller])
+
+            logger.debug(f"Pulling the full AP inventory from {controller} with '{inventory_command}'.")
+
+            with scan_cdp_AP_neighbor.controller_session(controller, username, password) as net_connect:
+                inventory_output = net_connect.send_command(inventory_command)
+            with affinity_lock:
+                ap_discovery_stats['controller_queries'] += 1
+
+            inventory_indexes[controller] = scan_cdp_AP_neighbor.parse_wlc_inventory(inventory_output)
+            logger.info(f"Indexed {len(inventory_indexes[controller])} APs from {controller}.")
+
+            return(inventory_indexes[controller])
+
+    def search_sequential(ap_list, username, password, controller_orders=None) -> dict:
+        """
+        This function asks the controllers one after another. Each controller is only asked about the APs every earlier controller missed.
+
+        controller_orders maps each AP to the order its controllers should be tried in (see route_aps). Without it, every AP follows wireless_controllers.
+        In round N, every AP still missing goes to the Nth controller in its own order, batched per controller.
+        A controller that fails is logged and skipped, the same as in search_fanout. Its APs are still tried on their next controller in the next round.
+
+        Returns a dict of {ap_name: [serial_num, controller]}.
+        """
+        controller_hosts = [controller['host'] for controller in wireless_controllers]
+        controllers_by_host = {controller['host']: controller for controller in wireless_controllers}
+
+        if controller_orders == None:
+            controller_orders = {ap: controller_hosts for ap in ap_list}
+
+        found_serials = {}
+
+        for round_number in range(len(controller_hosts)):
+            round_batches = {} # controller -> APs to ask it about this round.
+            for ap in ap_list:
+                if ap not in found_serials:
+                    round_batches.setdefault(controller_orders[ap][round_number], []).append(ap)
+
+            if len(round_batches) == 0:
+                break
+
+            for controller_host in controller_hosts:
+                if controller_host not in round_batches:
+                    continue
+
+                try:
+                    controller_serials = scan_cdp_AP_neighbor.wlc_ssh(controllers_by_host[controller_host], round_batches[controller_host], username, password)
+                except Exception as e:
+                    logger.error(f"AP discovery on {controller_host} failed: {e}")
+                    continue
+
+                for ap, serial_num in controller_serials.items():
+                    found_serials[ap] = [serial_num, controller_host]
+
+        return(found_serials)
+
+    def ap_name_prefix(ap) -> str:
+        """
+        This function returns the site code at the front of an AP name, e.g. 'abc' for 'abc-fl01-nr01-ap01'.
+        """
+        return(ap.split('-')[0].lower())
+
+    def open_affinity_store():
+        """
+        This function opens the learned AP -> controller affinity, kept in AP-AFFINITY-FILE. An empty AP-AFFINITY-FILE keeps it in memory for this run only.
+        """
+        return(persistent_cache.open(
+            os.environ.get('AP-AFFINITY-FILE', './output/ap-affinity.sqlite') or ':memory:',
+            'ap_affinity',
+            float(os.environ.get('AP-AFFINITY-TTL', 90 * 24 * 3600)), # Seconds. APs do move between controllers, so old answers eventually stop counting.
+        ))
+
+    def route_aps(ap_list, site) -> tuple:
+        """
+        This function picks the order the controllers are tried in for each AP, from the controllers that answered before.
+
+        An AP that was found before goes to that controller first. Otherwise the controller that answered most often for the AP's site
+        and AP-name prefix goes first. APs with no history follow wireless_controllers. Every order still ends with every controller, so misses fall back to the others.
+
+        Returns {ap_name: [controller, ...]}, and the set of APs that had any history to route on.
+        """
+        controller_hosts = [controller['host'] for controller in wireless_controllers]
+
+        with affinity_lock:
+            affinity = scan_cdp_AP_neighbor.open_affinity_store().get_many(
+                [('ap', ap) for ap in ap_list] + [('site', str(site))] + [('prefix', scan_cdp_AP_neighbor.ap_name_prefix(ap)) for ap in ap_list]
+            )
+
+        controller_orders = {}
+        routed_aps = set()
+
+        for ap in ap_list:
+            scores = dict.fromkeys(controller_hosts, 0)
+            for controller_host, answers in affinity.get(('site', str(site)), {}).items():
+                if controller_host in scores:
+                    scores[controller_host] += answers
+            for controller_host, answers in affinity.get(('prefix', scan_cdp_AP_neighbor.ap_name_prefix(ap)), {}).items():
+                if controller_host in scores:
+                    scores[controller_host] += answers
+
+            learned_controller = affinity.get(('ap', ap))
+            if learned_controller in scores:
+                scores[learned_controller] = float('inf')
+
+            controller_orders[ap] = sorted(controller_hosts, key=lambda controller_host: -scores[controller_host]) # sorted() is stable, so ties keep the wireless_controllers order.
+            if max(scores.values()) > 0:
+                routed_aps.add(ap)
+
+        return(controller_orders, routed_aps)
+
+    def learn_affinity(found_serials, site):
+        """
+        This function records which controller answered for each AP, and adds those answers to the counts for the AP's site and AP-name prefix.
+        """
+        if len(found_serials) == 0:
+            return
+
+        with affinity_lock:
+            affinity_store = scan_cdp_AP_neighbor.open_affinity_store()
+            group_keys = [('site', str(site))] + [('prefix', scan_cdp_AP_neighbor.ap_name_prefix(ap)) for ap in found_serials]
+            group_counts = affinity_store.get_many(group_keys)
+
+            learned = {}
+            for ap, (serial_num, controller_host) in found_serials.items():
+                learned[('ap', ap)] = controller_host
+
+                for group_key in [('site', str(site)), ('prefix', scan_cdp_AP_neighbor.ap_name_prefix(ap))]:
+                    counts = learned.setdefault(group_key, group_counts.get(group_key, {}))
+                    counts[controller_host] = counts.get(controller_host, 0) + 1
+
+            affinity_store.put_many(learned)
+
+    def search_fanout(ap_list, username, password) -> dict:
+        """
+        This function asks every controller about every AP at the same time, so AP discovery takes as long as the slowest controller, not the sum of all of them.
+
+        When more than one controller knows an AP, the earliest controller in wireless_controllers wins. A controller that fails is logged and skipped.
+
+        Returns a dict of {ap_name: [serial_num, controller]}.
+        """
+        found_serials = {}
+
+        with ThreadPoolExecutor(max_workers=len(wireless_controllers)) as executor:
+            controller_futures = [executor.submit(scan_cdp_AP_neighbor.wlc_ssh, controller, ap_list, username, password) for controller in wireless_controllers]
+
+            for controller, future in zip(wireless_controllers, controller_futures):
+                try:
+                    controller_serials = future.result()
+                except Exception as e:
+                    logger.error(f"AP discovery on {controller['host']} failed: {e}")
+                    continue
+
+                for ap, serial_num in controller_serials.items():
+                    found_serials.setdefault(ap, [serial_num, controller['host']])
+
+        return(found_serials)
 
     def ap_serial_discovery(ap_name, username, password):
         """
@@ -87,18 +333,9 @@ class scan_cdp_AP_neighbor():
         
         It works by calling other sub-functions that make SSH sessions with all WLCs and search them for serial info for the provided AP. 
         """
+        found_serials = scan_cdp_AP_neighbor.search_sequential([ap_name], username, password)
 
-        ap_serialnum = scan_cdp_AP_neighbor.wlc_5k_ssh(ap_name, username, password) # Check the 5k WLC for the AP info first. 
-
-        if ap_serialnum == False: # If the 5k returns 'False', that means the AP was not found on the WLC.
-            ap_serialnum = scan_cdp_AP_neighbor.wlc_9k_ssh(ap_name, username, password) # Pass the info to the 9k WLC for secondary discovery.
-            
-            if ap_serialnum == False: # If the serial still isn't found on the 9k, return 'NOTFOUND'
-                return('NOTFOUND')
-            else:
-                return(ap_serialnum)
-        else: 
-            return(ap_serialnum)
+        return(found_serials.get(ap_name, ['NOTFOUND'])[0]) # If the serial isn't found on any controller, return 'NOTFOUND'
 
     def format_apmacaddress(unformatted_macaddress) -> str:
         """
@@ -112,39 +349,91 @@ class scan_cdp_AP_neighbor():
         logger.debug(f"Raw MAC: {unformatted_macaddress} Formatted MAC: {formatted_mac}")
         return(formatted_mac)
 
-    def discoverApSerialNumbers(ap_list, username, password) -> list:
+    def open_serial_cache():
+        """
+        This function opens the on-disk AP serial cache named by AP-SERIAL-CACHE-FILE, or returns None if the cache is turned off.
+        """
+        return(persistent_cache.open(
+            os.environ.get('AP-SERIAL-CACHE-FILE', './output/ap-serial-cache.sqlite'),
+            'ap_serials',
+            float(os.environ.get('AP-SERIAL-CACHE-TTL', 30 * 24 * 3600)), # Seconds. An AP's serial never changes, so only renamed or re-homed APs ever need the controllers again.
+        ))
+
+    def count_affinity_hits(routed_aps, controller_orders, controller_serials):
+        """
+        This function counts, for every AP route_aps had history for, whether the controller it was sent to first was the one that answered.
+        """
+        with affinity_lock:
+            for ap in routed_aps:
+                ap_discovery_stats['routed_aps'] += 1
+                if ap in controller_serials and controller_serials[ap][1] == controller_orders[ap][0]:
+                    ap_discovery_stats['affinity_hits'] += 1
+                else:
+                    ap_discovery_stats['affinity_misses'] += 1
+
+    def discoverApSerialNumbers(ap_list, username, password, ap_macaddresses=None, site=None) -> list:
         """
         Takes in a list of AP names and returns a list of tuples. 
 
         Tuple format: [ap_name, serial]
+
+        Serials are looked up in the AP serial cache first, keyed by AP name plus its base-radio MAC from ap_macaddresses. Only misses and expired entries go to the controllers,
+        and whatever the controllers find is cached along with the controller that answered.
+
+        AP-CONTROLLER-MODE picks how the controllers are searched: 'sequential' (the default) or 'fanout'. In 'sequential' mode,
+        each AP goes to the controller that answered for it (or for its site and AP-name prefix) before, and falls back to the others on a miss.
         """
-        global output_list, wlc9k_search_list, unfound_AP_list
+        if ap_macaddresses == None:
+            ap_macaddresses = {}
 
-        output_list = []
-        wlc9k_search_list = []
-        unfound_AP_list = []
-        
-        print("\nBeginning AP discovery on both wireless-controllers...\n")
-        
-        # Start an SSH session with the 5k and look for serials. If found, append to output_list. If not found, do nothing?
-        scan_cdp_AP_neighbor.wlc_5k_ssh(ap_list, username, password)
+        serial_cache = scan_cdp_AP_neighbor.open_serial_cache()
+
+        found_serials = {}
+        if serial_cache != None:
+            cached_serials = serial_cache.get_many([(ap, ap_macaddresses.get(ap, '')) for ap in ap_list])
+            found_serials = {ap: cached_serial for (ap, ap_macaddress), cached_serial in cached_serials.items()}
+            logger.info(f"{len(found_serials)} of {len(ap_list)} AP serials served from the AP serial cache.")
 
-        if len(wlc9k_search_list) >= 1:
-            scan_cdp_AP_neighbor.wlc_9k_ssh(wlc9k_search_list, username, password)
+        search_list = [ap for ap in ap_list if ap not in found_serials]
+
+        if len(search_list) >= 1:
+            print(f"\nBeginning AP discovery on all wireless-controllers for {len(search_list)} APs ({len(found_serials)} cached)...\n")
+
+            if os.environ.get('AP-CONTROLLER-MODE', 'sequential') == 'fanout':
+                controller_serials = scan_cdp_AP_neighbor.search_fanout(search_list, username, password)
+            else:
+                controller_orders, routed_aps = scan_cdp_AP_neighbor.route_aps(search_list, site)
+                controller_serials = scan_cdp_AP_neighbor.search_sequential(search_list, username, password, controller_orders)
+                scan_cdp_AP_neighbor.count_affinity_hits(routed_aps, controller_orders, controller_serials)
+
+            scan_cdp_AP_neighbor.learn_affinity(controller_serials, site)
+
+            if serial_cache != None:
+                serial_cache.put_many({(ap, ap_macaddresses.get(ap, '')): controller_serial for ap, controller_serial in controller_serials.items()})
+
+            found_serials.update(controller_serials)
+
+        output_list = [[ap, found_serials[ap][0]] for ap in ap_list if ap in found_serials]
+        unfound_AP_list = [ap for ap in ap_list if ap not in found_serials]
 
         if len(unfound_AP_list) >= 1:
-            logger.critical(f"APs not found on either controller:\n\n{unfound_AP_list}\n\n")
+            logger.critical(f"APs not found on any controller:\n\n{unfound_AP_list}\n\n")
 
         return(output_list, unfound_AP_list)
 
     def __init__(self, site_data, site, ap_scan_list, username, password):
-        
-        global logger
-        
-        logger = myLogger(__name__)
+        """
+        Runs AP discovery for one site's ap_scan_list and adds an entry for every AP to site_data[site]['device_scan_data'].
 
+        All state lives in this call, so many sites can run it at once. The APs that no controller knew are in self.unfound_aps.
+        """
         ap_list = []
+        ap_macaddresses = {} # ap -> formatted base-radio MAC. Together with the name, this is the AP serial cache key.
         unfound_aps = []
+
+        if os.environ.get('DNS-RESOLVE-MODE', 'per-host') == 'bulk': # Resolve every AP of the site at once, so the loop below only reads the DNS cache.
+            dns_resolve_hostname.resolve_bulk([ap[1] for ap in ap_scan_list])
+
         for ap in ap_scan_list:
 
             parent_switch = ap[0]
@@ -159,6 +448,7 @@ class scan_cdp_AP_neighbor():
             switch =        parent_switch
             switchport =    site_data[site]['device_scan_data'][parent_switch]['cdp_neighbors'][ap]['local_port']
             ap_macaddress = scan_cdp_AP_neighbor.format_apmacaddress(site_data[site]['device_scan_data'][parent_switch]['cdp_neighbors'][ap]['ap_macaddress'])
+            ap_macaddresses[ap] = ap_macaddress
             
             dns_output = dns_resolve_hostname(ap)
             dns_name = dns_output.dns_hostname
@@ -182,7 +472,7 @@ class scan_cdp_AP_neighbor():
                 logger.error(f'DNS name does match hostname for {ap} {ip_addr}')
         
         # Here we'll make a list of all the AP names, then pass them ALL into an SSH session with the 5k and 9k WLCs for faster discovery.
-        ap_serial_data = scan_cdp_AP_neighbor.discoverApSerialNumbers(ap_list, username, password)
+        ap_serial_data = scan_cdp_AP_neighbor.discoverApSerialNumbers(ap_list, username, password, ap_macaddresses, site)
         
         for ap in ap_serial_data[0]:
             ap_name =    ap[0]
@@ -194,3 +484,5 @@ class scan_cdp_AP_neighbor():
             unfound_aps.append(unfound_ap)
 
         self.unfound_aps = unfound_aps
+
+logger = lazyLogger(__name__)
@@ -1,238 +1,288 @@
+import os
+import re
+import time
+import threading
+
+ssh_stats = {'connections': 0, 'cdp_ip_connections': 0, 'command_round_trips': 0, 'mac_lookups': 0, 'mac_table_fetches': 0} # Run-wide counters, so connections per run and AP MAC lookups can be compared.
+stats_lock = threading.Lock()
+
+interrogation_commands = { # The 'show' commands run against each device, per netmiko device_type. Every set needs the same five keys.
+    # Only cisco_ios is scanned today (IOS-XE answers the same commands through it). A new platform needs its own set here, and a device_type passed to discover_device_data.
+    "cisco_ios": {
+        "version": "show version | i Processor board ID",
+        "inventory": "show inventory",
+        "cdp": "show cdp entry *", # Retrieves the entire list of CDP neighbors from the device
+        "stp_macaddress": "show spanning-tree bridge address | i VLAN0001",
+        "stp_blockedports": "show spanning-tree blockedports | i VLAN0001",
+    },
+}
+
+serial_num_regex = re.compile(r"Processor board ID\s+(\S+)", re.IGNORECASE)
+model_num_regex = re.compile(r"PID:\s*([^\s,]+)")
+mac_table_regex = re.compile(r"^\W*(\d+)\s+([0-9a-fA-F]{4}\.[0-9a-fA-F]{4}\.[0-9a-fA-F]{4})\s+(STATIC|DYNAMIC)\s+(\S+)", re.IGNORECASE) # ref line: '250    7079.b362.9a7a    STATIC      Gi5/0/7 '
+port_name_regex = re.compile(r"^([A-Za-z-]+)\s*(\d.*)$")
+
+port_abbreviations = { # The MAC table shows short port names, while CDP shows long ones.
+    "FastEthernet": "Fa",
+    "GigabitEthernet": "Gi",
+    "TwoGigabitEthernet": "Tw",
+    "FiveGigabitEthernet": "Fi",
+    "TenGigabitEthernet": "Te",
+    "TwentyFiveGigE": "Twe",
+    "FortyGigabitEthernet": "Fo",
+    "HundredGigE": "Hu",
+    "AppGigabitEthernet": "Ap",
+    "Port-channel": "Po",
+    "Ethernet": "Et",
+}
+
 class scan_cdp_device():
 
-    def retrieve_macaddress(device, local_port, username, password):
+    def retrieve_macaddress(device, local_port, net_connect):
         """
-        This function is intended to SSH into a switch a retrieve a specific interface's MAC table entries.
+        This function retrieves a specific interface's MAC table entries over the switch's already-open SSH session.
         """
-        import re
-        from netmiko import ConnectHandler
-        
-        logger.debug(f"Beginning SSH session to {device} to retrieve MAC address from port {local_port}")
         
-        connection_details = { 
-            "device_type": "cisco_ios",
-            "host": device,
-            "username": username,
-            "password": password,
-            }
+        logger.debug(f"Retrieving MAC address from port {local_port} on {device} over the existing SSH session")
+
+        with stats_lock:
+            ssh_stats['mac_lookups'] += 1
 
         try:
-        
-            with ConnectHandler(**connection_details) as net_connect:
-                
-                command = f'show mac address-table interface {local_port} | i STATIC|DYNAMIC'
+            
+            command = f'show mac address-table interface {local_port} | i STATIC|DYNAMIC'
 
-                mac_output = net_connect.send_command(command) # Reference output string: '250    7079.b362.9a7a    STATIC      Gi5/0/7 '
-                
+            mac_output = net_connect.send_command(command) # Reference output string: '250    7079.b362.9a7a    STATIC      Gi5/0/7 '
+            
 
-                if "STATIC" in mac_output:
-                    ap_macaddress = mac_output.split(" STATIC")[0]
-                elif "DYNAMIC" in mac_output:
-                    ap_macaddress = mac_output.split(" DYNAMIC")[0]
+            if "STATIC" in mac_output:
+                ap_macaddress = mac_output.split(" STATIC")[0]
+            elif "DYNAMIC" in mac_output:
+                ap_macaddress = mac_output.split(" DYNAMIC")[0]
 
-                ap_macaddress = re.sub(' +', ' ', ap_macaddress).strip()
+            ap_macaddress = re.sub(' +', ' ', ap_macaddress).strip()
 
-                ap_macaddress = ap_macaddress.split(" ")[1].strip()
-                
-                logger.debug(f"Returning AP MAC address {ap_macaddress} found through regex parsing.")
-                return(ap_macaddress)
+            ap_macaddress = ap_macaddress.split(" ")[1].strip()
+            
+            logger.debug(f"Returning AP MAC address {ap_macaddress} found through regex parsing.")
+            return(ap_macaddress)
 
         except Exception as e: 
-            logger.debug(f"Failed to establish SSH session to {device} to retrieve MAC address from port {local_port} Reason: \n\n {e}")
+            logger.debug(f"Failed to retrieve MAC address from port {local_port} on {device}. Reason: \n\n {e}")
             return()
 
-    def parse_cdp_nei_data(device, cdp_neighbors_data, username, password):
+    def shorten_port_name(port) -> str:
         """
-        This function passes in a device_name and its corresponding CDP Neighbor Data.
+        This function turns a long port name into the short form used by the MAC table, so ports from CDP and the MAC table can be compared.
 
-        The function parses out the raw CDP data and returns a complete, formatted dictionary of the good stuff.
+        e.g. GigabitEthernet1/0/41 -> Gi1/0/41
         """
+        port_match = port_name_regex.match(port.strip())
 
-        cdp_neighbors = {}
-        
-        cdp_neighbor_list = cdp_neighbors_data.split("-------------------------") # Splitting up the CDP output into something usable
+        if port_match == None:
+            return(port.strip())
 
-        for cdp_neighbor in cdp_neighbor_list[1:]: # This for-loop parses out the CDP data and collects a few relevant variables, then stores them in a dictionary.
-            
-            is_ap = False # Sets these variables up so they don't accidentally get passed from one neighbor to the next. 
-            is_camera = False
-            is_phone = False
+        port_type, port_number = port_match.groups()
+        return(port_abbreviations.get(port_type, port_type) + port_number)
 
-            for line in cdp_neighbor.splitlines():
-                
-                if "Device ID:" in line:
-                    device_id = line.split(": ")[1]
-                    if '.' in device_id: # Filters out '.domain.com' suffixes
-                        device_id = device_id.split('.')[0]
-                
-                if "Port ID (outgoing port):" in line:
-                    remote_port = line.split(",  ")[1].split("Port ID (outgoing port): ")[1]
+    def retrieve_mac_table(device, net_connect) -> dict:
+        """
+        This function pulls the switch's whole static+dynamic MAC table in one command, over the switch's already-open SSH session.
 
-                if "Interface:" in line:
-                    local_port = line.split(",  ")[0].split("Interface: ")[1]
-                
-                if "IP address:" in line:
-                    ip_addr = line.split(",  ")[0].split("IP address: ")[1]
+        Returns a dict of short port name -> list of MAC addresses learned on that port.
+        """
+        logger.debug(f"Retrieving the full MAC address table from {device} over the existing SSH session")
 
-                if "Platform: " in line:
-                    if "Platform: cisco" in line:
-                        neighbor_platform = line.split("Platform: cisco ")[1]
-                    else:
-                        neighbor_platform = line.split("Platform: ")[1]
-                    
-                    neighbor_platform = neighbor_platform.split(",  Capabilities:")[0]
-            
-            if "Trans-Bridge" in cdp_neighbor:
-                logger.debug(f"Setting is_ap flag to TRUE for host {device_id} due to 'Trans-Bridge' being found in its CDP Capabilities.")
-                is_ap = True
+        with stats_lock:
+            ssh_stats['mac_table_fetches'] += 1
 
-                ap_macaddress = scan_cdp_device.retrieve_macaddress(device, local_port, username, password)
+        mac_output = net_connect.send_command('show mac address-table | i STATIC|DYNAMIC|static|dynamic')
 
-            else:
-                is_ap = False
-            
-            if "Capabilities: Host Phone" in cdp_neighbor:
-                is_phone = True
-            else:
-                is_phone = False
-            
-            if "Network Camera" in cdp_neighbor:
-                is_camera = True
-            else:
-                is_camera = False
-            
-            try: remote_port
-            except: remote_port = ''
+        return(scan_cdp_device.parse_mac_table(mac_output))
+
+    def parse_mac_table(mac_output) -> dict:
+        """
+        This function parses 'show mac address-table' output into a dict of short port name -> list of MAC addresses.
+        """
+        mac_table = {}
 
-            try: local_port
-            except: local_port = ''
+        for line in mac_output.splitlines():
+            mac_match = mac_table_regex.match(line)
 
-            try: ip_addr
-            except: ip_addr = ''
+            if mac_match == None:
+                continue
 
-            try: neighbor_platform
-            except: neighbor_platform = ''
+            port = scan_cdp_device.shorten_port_name(mac_match.group(4))
 
-            try: is_ap
-            except: is_ap = False
+            if port not in mac_table:
+                mac_table[port] = []
+            mac_table[port].append(mac_match.group(2).lower())
 
-            try: is_phone
-            except: is_phone = False
+        return(mac_table)
 
-            try: is_camera
-            except: is_camera = False
+    def parse_cdp_nei_data(device, cdp_neighbors_data, net_connect, mac_table=None):
+        """
+        This function passes in a device_name, its corresponding CDP Neighbor Data, and the device's open SSH session.
+
+        If a mac_table from retrieve_mac_table is passed in, AP MAC addresses are looked up in it instead of being queried per port.
+
+        The function parses out the raw CDP data with cdp_parser and returns a dictionary of NeighborRecord objects, keyed by device ID.
+        """
+        from cdp_parser import cdp_parser
+
+        cdp_neighbors = {}
 
-            cdp_neighbors[device_id] = {}
-            cdp_neighbors[device_id]['remote_port'] = remote_port
-            cdp_neighbors[device_id]['local_port'] = local_port
-            cdp_neighbors[device_id]['ip_addr'] = ip_addr
-            cdp_neighbors[device_id]['platform'] = neighbor_platform
-            cdp_neighbors[device_id]['is_ap'] = is_ap
-            cdp_neighbors[device_id]['is_phone'] = is_phone
-            cdp_neighbors[device_id]['is_camera'] = is_camera
-            cdp_neighbors[device_id]['scanned'] = False
+        for neighbor_record in cdp_parser.parse(cdp_neighbors_data):
 
-            if is_ap:
-                cdp_neighbors[device_id]['ap_macaddress'] = ap_macaddress
-                del ap_macaddress # Prevents this key from getting added to every CDP neighbor through looping logic
+            if neighbor_record.is_ap:
+                logger.debug(f"Setting is_ap flag to TRUE for host {neighbor_record.device_id} due to 'Trans-Bridge' being found in its CDP Capabilities.")
+
+                if mac_table != None:
+                    port_macs = mac_table.get(scan_cdp_device.shorten_port_name(neighbor_record.local_port), [])
+                    neighbor_record.ap_macaddress = port_macs[0] if len(port_macs) >= 1 else ()
+                else:
+                    neighbor_record.ap_macaddress = scan_cdp_device.retrieve_macaddress(device, neighbor_record.local_port, net_connect)
+
+            cdp_neighbors[neighbor_record.device_id] = neighbor_record
         
         return(cdp_neighbors)        
 
-    def ssh_interrogation(device, username, password) -> tuple:
+    def ssh_interrogation(device, net_connect, device_type="cisco_ios") -> tuple:
         """
-        This function SSHs into the provided device and issues a few 'show' commands. Then, it parses the output data for the desired variables. 
+        This function issues the device_type's 'show' command set over the device's open SSH session. Then, it parses the output data for the desired variables. 
+
+        If CDP-INTERROGATION-MODE is 'batched', the whole command set goes out in one round trip through the session's send_command_batch. Otherwise each command waits for its own prompt.
 
         Returns a tuple. 
 
         Tuple format: [model_num, serial_num, cdp_output, stp_macaddress, stp_blockedports_list]
 
-        If SSH fails to the device, this function returns a tuple [False, False, False, False, False]
+        If the commands fail on the device, this function returns a tuple [False, False, False, False, False]
         """
 
-        from netmiko import ConnectHandler
-
-        connection_details = { 
-        "device_type": "cisco_ios",
-        "host": device,
-        "username": username,
-        "password": password,
-        }
+        command_set = interrogation_commands[device_type]
 
         try:
-        
-            with ConnectHandler(**connection_details) as net_connect: # Pass the above connection_details dict. Open an SSH session and run multiple commands in order.
-                                    
-                serial_num_command = 'show version | i Processor board ID'
-                serial_num_output = net_connect.send_command(serial_num_command)
-                serial_num = serial_num_output.split('Processor board ID ')[1] # ref output: 'Processor board ID FOC1922S481'
 
-                model_num_command = f'show inventory | i {serial_num}'
-                model_num_output = net_connect.send_command(model_num_command)
-                model_num = model_num_output.split(' , ')[0] # ref output: 'PID: WS-C2960X-48FPS-L , VID: V06  , SN: FOC2127S3M7'
-                model_num = model_num.split('PID: ')[1].strip() # ref output: 'PID: ISR4431/K9       ' <-- notice the spaces between model and end-quote. The .strip() function removes these.
+            if os.environ.get('CDP-INTERROGATION-MODE', 'serial') == 'batched':
+                command_outputs = dict(zip(command_set.keys(), net_connect.send_command_batch(list(command_set.values()))))
+
+                with stats_lock:
+                    ssh_stats['command_round_trips'] += 1
+            
+            else:
+                command_outputs = {}
+                for command_name, command in command_set.items():
+                    command_outputs[command_name] = net_connect.send_command(command)
+                
+                with stats_lock:
+                    ssh_stats['command_round_trips'] += len(command_set)
 
-                cdp_command = "show cdp entry *" # Retrieves the entire list of CDP neighbors from the device
-                cdp_output = net_connect.send_command(cdp_command)
+            serial_num = serial_num_regex.search(command_outputs['version']).group(1) # ref output: 'Processor board ID FOC1922S481'
 
-                stp_mac_command = "show spanning-tree bridge address | i VLAN0001"
-                stp_mac_output = net_connect.send_command(stp_mac_command)
+            model_num = False
+            for line in command_outputs['inventory'].splitlines(): # ref output: 'PID: WS-C2960X-48FPS-L , VID: V06  , SN: FOC2127S3M7'
+                if f"SN: {serial_num}" in line:
+                    model_num = model_num_regex.search(line).group(1)
+                    break
 
-                if 'VLAN0001         ' in stp_mac_output:
+            if model_num == False:
+                raise ValueError(f"No inventory entry found for serial {serial_num} on {device}.")
 
-                    stp_macaddress = stp_mac_output.split('VLAN0001         ')[1]
-                
-                else:
-                    stp_macaddress = ''
-                    logger.debug(f"Could not determine STP MAC for device {device}")
+            cdp_output = command_outputs['cdp']
 
-                stp_blockedports_command = "show spanning-tree blockedports | i VLAN0001"
-                stp_blockedports_output = net_connect.send_command(stp_blockedports_command)
-                
-                if 'VLAN0001             ' in stp_blockedports_output:
-                    stp_blockedports_list = []
-                    for line in stp_blockedports_output:
+            stp_mac_output = command_outputs['stp_macaddress']
+
+            if 'VLAN0001         ' in stp_mac_output:
+
+                stp_macaddress = stp_mac_output.split('VLAN0001         ')[1]
+            
+            else:
+                stp_macaddress = ''
+                logger.debug(f"Could not determine STP MAC for device {device}")
+
+            stp_blockedports_output = command_outputs['stp_blockedports']
+            
+            if 'VLAN0001             ' in stp_blockedports_output:
+                stp_blockedports_list = []
+                for line in stp_blockedports_output.splitlines():
+                    if 'VLAN0001             ' in line:
                         stp_blocked_port = line.split('VLAN0001             ')[1]
                         stp_blockedports_list.append(stp_blocked_port)
-                
-                else:
-                    stp_blockedports_list = ''
+            
+            else:
+                stp_blockedports_list = ''
             
             print(f"SSH connection to {device} successful.")
             logger.info(f"SSH connection to {device} successful.")
             
             return(model_num, serial_num, cdp_output, stp_macaddress, stp_blockedports_list)
 
-        except:
-            print(f"""SSH connection to {device} failed. 
+        except Exception as e:
+            print(f"""SSH interrogation of {device} failed. 
                 Returning FALSE for attributes: model_num, serial_num, cdp_output, stp_macaddress, stp_blockedports_list""")
                 
-            logger.critical(f"SSH connection to {connection_details['host']} failed inside scan_seed_device.ssh_interrogation.")
+            logger.critical(f"SSH interrogation of {device} failed inside scan_cdp_device.ssh_interrogation. Reason: {e}")
             return(False, False, False, False, False) 
     
-    def discover_device_data(device, username, password) -> tuple:
+    def discover_device_data(device, username, password, device_type="cisco_ios", connect_host=None) -> tuple:
         """
-        This functions first runs the 'ssh_interrogation' function to gather data via SSH. 
+        This functions opens a single SSH session to the device and keeps it open for every command the scan needs.
 
-        Then, it parses the retrieved CDP-Neighbor data, and parses it with the 'parse_cdp_nei_data' function.
+        First, it runs the 'ssh_interrogation' function to gather data over the session. 
+        Then, it parses the retrieved CDP-Neighbor data with the 'parse_cdp_nei_data' function, which reuses the same session for AP MAC lookups.
 
         Returns a tuple. 
 
-        Tuple format: [platform, serial_num, cdp_neighbors_dict, stp_macaddress, stp_blockedports_list, scanned]
+        Tuple format: [platform, serial_num, cdp_neighbors_dict, stp_macaddress, stp_blockedports_list, scanned, mac_table]
+
+        The mac_table is only fetched when CDP-MAC-TABLE-MODE is 'bulk' and the device has AP neighbors. Otherwise it is an empty dict.
+
+        connect_host is the address the SSH session is opened to, e.g. the management IP the parent advertised over CDP. It defaults to the device name.
 
         Note: If SSH scan fails, multiple 'False' values are returned, so it does not continue with CDP neighbor scanning, then returns 'False' for respective variables in tuple. 
         """
-        
-        platform, serial_num, cdp_neighbors_data, stp_macaddress, stp_blockedports_list = scan_cdp_device.ssh_interrogation(device, username, password)
+        from ssh_transport import ssh_transport
 
-        if platform != False: # The above function returns 'False' if SSH fails for whatever reason.
-            scanned = True
-            cdp_neighbors_dict = scan_cdp_device.parse_cdp_nei_data(device, cdp_neighbors_data, username, password)
-            return([platform, serial_num, cdp_neighbors_dict, stp_macaddress, stp_blockedports_list, scanned])
-        
-        else:
-            return([False, False, False, False, False, True])  
+        connection_details = { 
+        "device_type": device_type,
+        "host": connect_host if connect_host else device,
+        "username": username,
+        "password": password,
+        }
+
+        try:
+
+            with ssh_transport.connect(**connection_details) as net_connect: # Pass the above connection_details dict. Open one SSH session and run every command in order.
+
+                with stats_lock:
+                    ssh_stats['connections'] += 1
+
+                platform, serial_num, cdp_neighbors_data, stp_macaddress, stp_blockedports_list = scan_cdp_device.ssh_interrogation(device, net_connect, device_type)
+
+                if platform != False: # The above function returns 'False' if the commands fail for whatever reason.
+                    scanned = True
+                    mac_table = {}
+
+                    if os.environ.get('CDP-MAC-TABLE-MODE', 'per-port') == 'bulk' and "Trans-Bridge" in cdp_neighbors_data: # One MAC table pull serves every AP on the switch.
+                        mac_table = scan_cdp_device.retrieve_mac_table(device, net_connect)
+                        cdp_neighbors_dict = scan_cdp_device.parse_cdp_nei_data(device, cdp_neighbors_data, net_connect, mac_table)
+                    else:
+                        cdp_neighbors_dict = scan_cdp_device.parse_cdp_nei_data(device, cdp_neighbors_data, net_connect)
+
+                    return([platform, serial_num, cdp_neighbors_dict, stp_macaddress, stp_blockedports_list, scanned, mac_table])
+                
+                else:
+                    return([False, False, False, False, False, True, {}])  
 
-    def __init__(self, device, username, password):
+        except Exception as e:
+            print(f"""SSH connection to {device} failed. 
+                Returning FALSE for attributes: model_num, serial_num, cdp_output, stp_macaddress, stp_blockedports_list""")
+
+            logger.critical(f"SSH connection to {connection_details['host']} failed inside scan_cdp_device.discover_device_data. Reason: {e}")
+            return([False, False, False, False, False, True, {}])
+
+    def __init__(self, device, username, password, cdp_ip_addr=''):
         global logger
         
         from logger import myLogger
@@ -241,19 +291,36 @@ class scan_cdp_device():
         logger = myLogger(__name__)
 
         print(f"Scanning {device}...")
-        dns_output = dns_resolve_hostname(device)      
 
-        if dns_output.ip_addr == False:
-            self.ip_addr = ''
+        if cdp_ip_addr != '' and os.environ.get('CDP-CONNECT-MODE', 'dns') == 'cdp-ip': # The parent already advertised the management IP over CDP, so connect straight to it. dns_name is filled in later, in one batch per site.
+            self.ip_addr = cdp_ip_addr
             self.dns_name = ''
-        
-        else:
-            ip_addr = dns_output.ip_addr
-            dns_hostname = dns_output.dns_hostname
+            connect_host = cdp_ip_addr
+
+            with stats_lock:
+                ssh_stats['cdp_ip_connections'] += 1
+
+        else: # No IP was advertised (e.g. the seed device), or CDP-CONNECT-MODE is 'dns'. Resolve the name first, like always.
+            connect_host = device
+            dns_output = dns_resolve_hostname(device)      
+
+            if dns_output.ip_addr == False:
+                self.ip_addr = ''
+                self.dns_name = ''
             
-            self.ip_addr = ip_addr
-            self.dns_name = dns_hostname
+            else:
+                ip_addr = dns_output.ip_addr
+                dns_hostname = dns_output.dns_hostname
+                
+                self.ip_addr = ip_addr
+                self.dns_name = dns_hostname
 
         
-        self.platform, self.serial_num, self.cdp_neighbors, self.stp_macaddress, self.stp_blockedports, self.scanned = scan_cdp_device.discover_device_data(device, username, password)
+        scan_start = time.perf_counter()
+        self.platform, self.serial_num, self.cdp_neighbors, self.stp_macaddress, self.stp_blockedports, self.scanned, self.mac_table = scan_cdp_device.discover_device_data(device, username, password, connect_host=connect_host)
+        self.scan_seconds = time.perf_counter() - scan_start
         self.hostname = device
+
+        if self.cdp_neighbors != False:
+            ap_count = len([nei for nei in self.cdp_neighbors.values() if nei['is_ap'] == True])
+            logger.info(f"Scanned {device} in {self.scan_seconds:.2f} seconds over one SSH session, including {ap_count} AP MAC lookups ({'one bulk MAC table fetch' if self.mac_table else 'per-port MAC queries'}).")
@@ -0,0 +1,117 @@
+import os
+import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import lazyLogger
+from persistent_cache import persistent_cache
+
+reachability_stats = {'probed': 0, 'unreachable': 0, 'cache_skipped': 0} # Run-wide counters, so the time saved on dead devices can be seen in the run summary.
+stats_lock = threading.Lock()
+
+class ssh_reachability():
+    """
+    This class screens a discovery wave for devices that cannot be reached on the SSH port, before any SSH session is attempted.
+
+    Every device is first checked against the negative cache of recently unreachable hosts. The rest are probed with short, parallel TCP connects.
+    A device that fails the probe is kept in the negative cache and skipped until its retry time, which doubles on every failure in a row.
+    """
+
+    def open_negative_cache():
+        """
+        This function opens the negative cache, kept in SSH-NEGATIVE-CACHE-FILE. An empty SSH-NEGATIVE-CACHE-FILE keeps it in memory for this run only.
+        """
+        return(persistent_cache.open(
+            os.environ.get('SSH-NEGATIVE-CACHE-FILE', './output/ssh-negative-cache.sqlite') or ':memory:',
+            'unreachable_hosts',
+            float(os.environ.get('SSH-NEGATIVE-CACHE-TTL', 7 * 24 * 3600)), # Seconds. After this long without a failure, a host's failure count starts over.
+        ))
+
+    def probe(host) -> bool:
+        """
+        This function returns True if a TCP connection to the host's SSH port opens within SSH-PROBE-TIMEOUT seconds.
+        """
+        try:
+            with socket.create_connection((host, int(os.environ.get('SSH-PROBE-PORT', 22))), timeout=float(os.environ.get('SSH-PROBE-TIMEOUT', 1.5))):
+                return(True)
+
+        except OSError as e:
+            logger.debug(f"SSH port probe of {host} failed. Reason: {e}")
+            return(False)
+
+    def probe_many(hosts) -> dict:
+        """
+        This function probes every host at once, on a pool of at most SSH-PROBE-WORKERS threads, so a wave costs one probe timeout instead of one per dead device.
+
+        Returns {host: True/False}.
+        """
+        hosts = list(dict.fromkeys(hosts))
+
+        if len(hosts) == 0:
+            return({})
+
+        with ThreadPoolExecutor(max_workers=min(len(hosts), max(1, int(os.environ.get('SSH-PROBE-WORKERS', 64))))) as executor:
+            return(dict(zip(hosts, executor.map(ssh_reachability.probe, hosts))))
+
+    def retry_delay(failures) -> float:
+        """
+        This function returns how long a host is skipped after its n-th failure in a row: SSH-NEGATIVE-CACHE-BACKOFF seconds, doubled per failure, up to SSH-NEGATIVE-CACHE-MAX-BACKOFF.
+        """
+        base_delay = float(os.environ.get('SSH-NEGATIVE-CACHE-BACKOFF', 300))
+        max_delay = float(os.environ.get('SSH-NEGATIVE-CACHE-MAX-BACKOFF', 24 * 3600))
+
+        return(min(base_delay * (2 ** (failures - 1)), max_delay))
+
+    def screen(devices) -> dict:
+        """
+        This function sorts a wave's devices by whether they are worth an SSH session.
+
+        devices is {device: probe_address}. The probe address is whatever the SSH session would be opened to, e.g. the CDP-advertised IP or the device name.
+        The negative cache is keyed by device name, so a dead device is remembered no matter which address it was reached on.
+
+        Returns {'reachable': [...], 'cache_skipped': [...], 'unreachable': [...]}. cache_skipped devices were not probed at all; unreachable devices failed a fresh probe.
+        """
+        negative_cache = ssh_reachability.open_negative_cache()
+        now = time.time()
+        screened = {'reachable': [], 'cache_skipped': [], 'unreachable': []}
+
+        cached_failures = negative_cache.get_many(list(devices.keys()))
+        probe_devices = []
+
+        for device in devices.keys():
+            if device in cached_failures and cached_failures[device]['retry_after'] > now:
+                screened['cache_skipped'].append(device)
+            else:
+                probe_devices.append(device)
+
+        probe_results = ssh_reachability.probe_many([devices[device] for device in probe_devices])
+        new_failures = {}
+
+        for device in probe_devices:
+            if probe_results[devices[device]] == True:
+                screened['reachable'].append(device)
+
+                if device in cached_failures: # Back up again, so its failure count starts over.
+                    negative_cache.delete(device)
+
+            else:
+                screened['unreachable'].append(device)
+                failures = cached_failures[device]['failures'] + 1 if device in cached_failures else 1
+                new_failures[device] = {'failures': failures, 'retry_after': now + ssh_reachability.retry_delay(failures)}
+
+                logger.warning(f"{device} ({devices[device]}) did not answer on the SSH port. Failure {failures} in a row; skipping it for {ssh_reachability.retry_delay(failures):.0f} seconds.")
+
+        if len(new_failures) >= 1:
+            negative_cache.put_many(new_failures)
+
+        with stats_lock:
+            reachability_stats['probed'] += len(probe_devices)
+            reachability_stats['unreachable'] += len(screened['unreachable'])
+            reachability_stats['cache_skipped'] += len(screened['cache_skipped'])
+
+        logger.info(f"Screened {len(devices)} devices: {len(screened['reachable'])} reachable, {len(screened['unreachable'])} failed the probe, {len(screened['cache_skipped'])} skipped by the negative cache.")
+
+        return(screened)
+
+logger = lazyLogger(__name__)
@@ -0,0 +1,213 @@
+import os
+import re
+import time
+import threading
+
+import yaml
+
+from logger import lazyLogger
+
+replay_recordings = {} # host -> {command: output}. Filled from SSH-RECORD-DIR on demand, or directly by tools like the crawl benchmark.
+recordings_lock = threading.Lock()
+
+class netmiko_session():
+    """
+    The default backend. This is a thin wrapper around a netmiko ConnectHandler session.
+    """
+
+    def send_command(self, command) -> str:
+        return(self.net_connect.send_command(command))
+
+    def send_command_batch(self, commands) -> list:
+        """
+        This function sends a whole command set to the device in one write, instead of waiting for the prompt after every command.
+
+        It reads until the prompt comes back after the last command's echo, then splits the combined output back into one output per command,
+        using each echoed 'prompt + command' line as the marker. Netmiko already sets 'terminal length 0' once when the session opens.
+
+        Returns a list of outputs in the same order as the commands.
+        """
+        prompt = self.net_connect.find_prompt()
+
+        self.net_connect.write_channel(self.net_connect.RETURN.join(commands) + self.net_connect.RETURN)
+        combined_output = self.net_connect.read_until_pattern(
+            pattern=re.escape(prompt + commands[-1]) + r"[\s\S]*?" + re.escape(prompt),
+            read_timeout=batch_read_timeout,
+        )
+        combined_output = combined_output.replace("\r\n", "\n").replace("\r", "\n")
+
+        command_outputs = []
+        search_start = 0
+
+        for command in commands:
+            marker = prompt + command
+            marker_index = combined_output.find(marker, search_start)
+
+            if marker_index == -1:
+                raise ValueError(f"Could not find the echo of '{command}' in the batched output from {self.host}.")
+
+            output_start = combined_output.find("\n", marker_index) + 1
+            output_end = combined_output.find(prompt, output_start)
+            if output_end == -1:
+                output_end = len(combined_output)
+
+            command_outputs.append(combined_output[output_start:output_end].strip("\n"))
+            search_start = output_end
+
+        return(command_outputs)
+
+    def find_prompt(self) -> str:
+        return(self.net_connect.find_prompt())
+
+    def is_alive(self) -> bool:
+        return(self.net_connect.is_alive())
+
+    def disconnect(self):
+        self.net_connect.disconnect()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+    def __init__(self, device_type, host, username, password):
+        from netmiko import ConnectHandler
+
+        self.host = host
+        self.net_connect = ConnectHandler(device_type=device_type, host=host, username=username, password=password)
+
+class recording_session(netmiko_session):
+    """
+    A live netmiko session that also captures every command -> output pair, then saves them to SSH-RECORD-DIR/<host>.yml on disconnect.
+
+    The saved files are what replay_session serves back later.
+    """
+
+    def send_command(self, command) -> str:
+        output = netmiko_session.send_command(self, command)
+        self.recorded[command] = output
+        return(output)
+
+    def send_command_batch(self, commands) -> list:
+        outputs = netmiko_session.send_command_batch(self, commands)
+        for command, output in zip(commands, outputs):
+            self.recorded[command] = output
+        return(outputs)
+
+    def find_prompt(self) -> str:
+        prompt = netmiko_session.find_prompt(self)
+        self.recorded['__prompt__'] = prompt
+        return(prompt)
+
+    def disconnect(self):
+        netmiko_session.disconnect(self)
+
+        record_file = ssh_transport.recording_path(self.host)
+        os.makedirs(os.path.dirname(record_file), exist_ok=True)
+
+        with recordings_lock: # Merge with anything captured for this host earlier, e.g. by a separate AP MAC session.
+            recorded = {}
+            if os.path.exists(record_file):
+                with open(record_file, 'r') as infile:
+                    recorded = yaml.safe_load(infile) or {}
+
+            recorded.update(self.recorded)
+
+            with open(record_file, 'w+') as outfile:
+                yaml.dump(recorded, outfile)
+
+        logger.debug(f"Recorded {len(self.recorded)} command outputs for {self.host} to {record_file}")
+
+    def __init__(self, device_type, host, username, password):
+        netmiko_session.__init__(self, device_type, host, username, password)
+        self.recorded = {}
+
+class replay_session():
+    """
+    An offline backend that serves outputs recorded by recording_session, so parsing, scheduling and merging can be profiled without live gear.
+
+    Every round trip sleeps for SSH-REPLAY-LATENCY seconds, and opening the session sleeps for SSH-REPLAY-CONNECT-LATENCY seconds.
+    Hosts with no recording fail to connect, just like an unreachable device. Commands with no recording return an empty string.
+    """
+
+    def send_command(self, command) -> str:
+        time.sleep(self.latency)
+        return(self.recorded.get(command, ''))
+
+    def send_command_batch(self, commands) -> list:
+        time.sleep(self.latency) # The whole batch is a single round trip.
+        return([self.recorded.get(command, '') for command in commands])
+
+    def find_prompt(self) -> str:
+        time.sleep(self.latency)
+        return(self.recorded.get('__prompt__', f"{self.host}#"))
+
+    def is_alive(self) -> bool:
+        return(True)
+
+    def disconnect(self):
+        pass
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+    def __init__(self, device_type, host, username, password):
+        self.host = host
+        self.latency = float(os.environ.get('SSH-REPLAY-LATENCY', 0)) # Simulated seconds per round trip.
+        self.recorded = ssh_transport.load_recording(host)
+
+        if self.recorded == None:
+            time.sleep(float(os.environ.get('SSH-REPLAY-TIMEOUT', 0))) # Simulated seconds a live connect to a dead host would hang before failing.
+            raise ConnectionError(f"No recorded session for {host}.")
+
+        time.sleep(float(os.environ.get('SSH-REPLAY-CONNECT-LATENCY', 0))) # Simulated seconds per SSH handshake.
+
+class ssh_transport():
+    """
+    This class picks the SSH backend for every session the crawler opens, based on SSH-TRANSPORT in the .env file.
+
+    'netmiko' (default) talks to live devices. 'record' talks to live devices and saves every output. 'replay' serves saved outputs offline.
+    """
+
+    backends = {
+        'netmiko': netmiko_session,
+        'record': recording_session,
+        'replay': replay_session,
+    }
+
+    def recording_path(host) -> str:
+        return(os.path.join(os.environ.get('SSH-RECORD-DIR', './output/ssh-recordings'), f"{host}.yml"))
+
+    def load_recording(host):
+        """
+        This function returns the recorded command -> output dict for a host, or None if the host was never recorded.
+        """
+        with recordings_lock:
+            if host in replay_recordings:
+                return(replay_recordings[host])
+
+            record_file = ssh_transport.recording_path(host)
+            if not os.path.exists(record_file):
+                return(None)
+
+            with open(record_file, 'r') as infile:
+                replay_recordings[host] = yaml.safe_load(infile) or {}
+
+            return(replay_recordings[host])
+
+    def connect(device_type, host, username, password):
+        """
+        This function opens a session to the host with the configured backend. Use it as a context manager, the same way as a netmiko ConnectHandler.
+        """
+        backend = os.environ.get('SSH-TRANSPORT', 'netmiko')
+        logger.debug(f"Opening {backend} session to {host} as {device_type}")
+
+        return(ssh_transport.backends[backend](device_type, host, username, password))
+
+logger = lazyLogger(__name__)
+
+batch_read_timeout = 60 # Seconds to wait for the whole batched command set to come back.